@@ -1,18 +1,23 @@
+import asyncio
 import json
 import os
 import re
+import sys
 from pathlib import Path
 
-import yaml
-from github import Github, GithubException
 from thefuzz import process
 
 GITHUB_TOKEN = os.environ["GITHUB_TOKEN"]
 GITHUB_REPOSITORY = os.environ["GITHUB_REPOSITORY"]
 PR_NUMBER = int(os.environ["PR_NUMBER"])
+# Set by GitHub Actions
+GITHUB_API_URL = os.environ.get("GITHUB_API_URL", "https://api.github.com")
 GH_PATH = Path(__file__).parent.parent
+sys.path.insert(0, str(GH_PATH.parent))
+from _loader import safe_load
+from scripts.forge import ForgeClient, ForgeError, map_bounded
 # https://github.com/github-linguist/linguist/blob/main/lib/linguist/languages.yml
-GH_LANGUAGES = set(yaml.safe_load(open(GH_PATH / "languages.yml")).keys()) | {"Delphi"}
+GH_LANGUAGES = set(safe_load(open(GH_PATH / "languages.yml")).keys()) | {"Delphi"}
 KNOWN_FRAMEWORKS = [
   '.NET',
   'Adobe AIR',
@@ -152,30 +157,49 @@ MIN_FUZZ_SCORE = 95
 unknown_languages = False
 unknown_frameworks = False
 
-g = Github(GITHUB_TOKEN)
-repo = g.get_repo(GITHUB_REPOSITORY)
-pr = repo.get_pull(PR_NUMBER)
-print("PR", pr.url)
+GAMES_FILE_REGEX = re.compile(r"^(games|originals)/\w+\.yaml$")
+
+
+async def fetch_pr():
+    """The PR, its changed files, and the text of its games files before and after, fetched concurrently"""
+    async with ForgeClient(tokens={"github": GITHUB_TOKEN}, cache_path=None, api_urls={"github": GITHUB_API_URL}) as client:
+        pr = await client.get_json("github", f"/repos/{GITHUB_REPOSITORY}/pulls/{PR_NUMBER}")
+        files = await client.get_pages("github", f"/repos/{GITHUB_REPOSITORY}/pulls/{PR_NUMBER}/files?per_page=100")
+        versions = [
+            (file["filename"], sha)
+            for file in files if GAMES_FILE_REGEX.match(file["filename"])
+            for sha in (pr["base"]["sha"], pr["head"]["sha"])
+        ]
+
+        async def get_contents(version):
+            filename, sha = version
+            try:
+                return await client.github_file(GITHUB_REPOSITORY, filename, sha)
+            except ForgeError as e:
+                # Files added or removed by the PR
+                print("Cannot get file at", filename, e)
+                return None
+
+        return pr, files, dict(zip(versions, await map_bounded(get_contents, versions)))
+
+
+pr, files, contents = asyncio.run(fetch_pr())
+print("PR", pr["url"])
 output = {
     "content": "Hey there! Thanks for contributing a PR to osgameclones! 🎉",
-    "labels": set(label.name for label in pr.labels),
+    "labels": set(label["name"] for label in pr["labels"]),
     "pr": PR_NUMBER,
 }
 
 # Get game changes
-files = pr.get_files()
-changed_files = [str(file) for file in files]
+changed_files = [file["filename"] for file in files]
 print("Changed files", changed_files)
 
 
 def load_games_file(filename: str, sha: str) -> dict[str, dict]:
-    try:
-        contents = repo.get_contents(filename, sha)
-    except GithubException as e:
-        print("Cannot get file at", filename, e)
+    if (file := contents.get((filename, sha))) is None:
         return {}
-    file = contents.decoded_content.decode()
-    parsed = yaml.safe_load(file)
+    parsed = safe_load(file)
     return {game["name"]: game for game in parsed}
 
 
@@ -290,15 +314,15 @@ games_removed = set()
 has_py = False
 has_js = False
 check_messages = []
-for file in files:
-    if file.filename.endswith(".py"):
+for filename in changed_files:
+    if filename.endswith(".py"):
         has_py = True
-    elif file.filename.endswith(".js"):
+    elif filename.endswith(".js"):
         has_js = True
-    elif re.match(r"^games/\w+\.yaml$", file.filename):
-        print("Game file changed", file)
-        old_games = load_games_file(file.filename, pr.base.sha)
-        new_games = load_games_file(file.filename, pr.head.sha)
+    elif re.match(r"^games/\w+\.yaml$", filename):
+        print("Game file changed", filename)
+        old_games = load_games_file(filename, pr["base"]["sha"])
+        new_games = load_games_file(filename, pr["head"]["sha"])
 
         for game in old_games:
             if game not in new_games:
@@ -316,10 +340,10 @@ for file in files:
                     games_changed.add(name)
                     for message in common_checks(new_games[name]):
                         check_messages.append(message)
-    elif re.match(r"^originals/\w+\.yaml$", file.filename):
-        print("Original file changed", file)
-        old_origs = load_games_file(file.filename, pr.base.sha)
-        new_origs = load_games_file(file.filename, pr.head.sha)
+    elif re.match(r"^originals/\w+\.yaml$", filename):
+        print("Original file changed", filename)
+        old_origs = load_games_file(filename, pr["base"]["sha"])
+        new_origs = load_games_file(filename, pr["head"]["sha"])
         for name in new_origs:
             if name not in old_origs:
                 for message in common_original_checks(new_origs[name]):
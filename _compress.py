@@ -0,0 +1,75 @@
+"""
+Compressed copies of the text files of a build, for render.py --precompress
+
+Every text file gets a .gz sibling, for nginx to serve with gzip_static instead
+of compressing every response. Siblings take the modification time of their
+file, so that files unchanged since the previous build are not compressed
+again.
+
+`python _compress.py _build` compresses a build after the fact, e.g. once
+`make min` has rewritten its index.html.
+"""
+import gzip
+import logging
+import os, os.path as op
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+# _clones/clones.ndjson is left out: the edit form reads it by byte ranges, which must be of the file itself
+EXTENSIONS = ('.html', '.css', '.js', '.json', '.xml', '.svg', '.txt')
+SUFFIX = '.gz'
+
+
+def is_fresh(path, mtime_ns):
+    try:
+        return os.stat(path).st_mtime_ns == mtime_ns
+    except OSError:
+        return False
+
+
+def compress_file(path) -> bool:
+    """Write the compressed sibling of ``path`` if it is missing or older than it, and tell if it was"""
+    stat = os.stat(path)
+    dst = path + SUFFIX
+    if is_fresh(dst, stat.st_mtime_ns):
+        return False
+    with open(path, 'rb') as f:
+        content = f.read()
+    # Write to a temporary file first so nginx never serves a truncated sibling
+    tmp_path = f'{dst}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        # No timestamp in the header, so that a file always compresses to the same bytes
+        f.write(gzip.compress(content, 9, mtime=0))
+    os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(tmp_path, dst)
+    return True
+
+
+def precompress(target, workers=None):
+    """Compress the text files under ``target`` in a pool of threads, and remove the siblings of removed files"""
+    paths = []
+    for root, dirs, files in os.walk(target):
+        for name in files:
+            path = op.join(root, name)
+            if name.endswith(EXTENSIONS):
+                paths.append(path)
+            elif name.endswith(SUFFIX) and not op.exists(path[:-len(SUFFIX)]):
+                log.info(f'Removing stale {path}')
+                os.remove(path)
+                try:
+                    os.removedirs(root)
+                except OSError:
+                    # Directory still holds other outputs
+                    pass
+    # zlib releases the GIL while compressing
+    with ThreadPoolExecutor(workers) as executor:
+        compressed = sum(executor.map(compress_file, paths))
+    log.info(f'Compressed {compressed} of {len(paths)} text files')
+
+
+if __name__ == '__main__':
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    precompress(sys.argv[1] if len(sys.argv) > 1 else '_build')
@@ -1,24 +1,107 @@
-import copy
+import hashlib
+import pickle
 import sys
 import pprint
+import re
 import os, os.path as op
 from dataclasses import dataclass
 from datetime import date, datetime, timedelta
 from collections import OrderedDict
-from functools import partial
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
 from typing import List, Dict
 import unicodedata
 from urllib.parse import urlparse
 
 import yaml
-from natsort import natsorted, ns
+from natsort import natsort_keygen, ns
 from pykwalify.core import Core
 from slugify import slugify
 
+import _validator
+from _profile import NULL_PROFILER
+from _loader import safe_load
 
-@dataclass
+VALIDATORS = ['pykwalify', 'compiled']
+
+
+class Record(Mapping):
+    """
+    An entry of the games database, read like the dict it was parsed from or through attributes
+
+    Records hold their values in a tuple, with the positions of their keys shared
+    between all the records with the same keys in the same order, so that every
+    clone listed under every original does not take a dict of its own.
+    """
+    __slots__ = ('_keys', '_values')
+
+    # Positions of the keys of every distinct sequence of keys
+    _shapes = {}
+
+    def __init__(self, entry):
+        keys = tuple(entry)
+        shape = Record._shapes.get(keys)
+        if shape is None:
+            shape = Record._shapes[keys] = {key: i for i, key in enumerate(keys)}
+        self._keys = shape
+        self._values = tuple(entry.values())
+
+    def __getitem__(self, key):
+        return self._values[self._keys[key]]
+
+    def __getattr__(self, name):
+        # Only called for names that are not slots or methods
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self._values[self._keys[name]]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return f'Record({dict(self)!r})'
+
+    def __reduce__(self):
+        # Rebuilt through __init__, to share shapes again in the processes rendering pages
+        return Record, (self.as_dict(),)
+
+    def as_dict(self) -> dict:
+        return dict(zip(self._keys, self._values))
+
+    def sizeof(self) -> int:
+        """Bytes taken by the record, without the values and keys it shares"""
+        return sys.getsizeof(self) + sys.getsizeof(self._values)
+
+
+# Keys of clones with values from a small set, interned so that clones share them
+INTERNED_KEYS = ['type', 'status', 'development', 'content', 'langs', 'frameworks', 'licenses', 'platforms',
+                 'multiplayer']
+
+
+def intern_values(entry, keys=INTERNED_KEYS):
+    """Intern the values of ``keys`` in a validated ``entry``, strings or lists of strings, in place"""
+    for key in keys:
+        if key in entry:
+            value = entry[key]
+            if isinstance(value, str):
+                entry[key] = sys.intern(value)
+            else:
+                value[:] = map(sys.intern, value)
+
+
+@dataclass(slots=True)
 class Game:
-    item: Dict
+    item: Record
     meta: Dict
     clones: List
 
@@ -79,29 +162,35 @@ def parse_unicode_tag(tag):
     return parse_tag(parse_unicode(tag))
 
 
-def parse_tags(entry, keys):
-    tags = []
+@lru_cache(maxsize=None)
+def normalize_tag(value: str) -> str:
+    """The tag of a value, computed and interned once for every distinct value"""
+    return sys.intern(parse_unicode_tag(value))
 
-    for key in keys:
-        if key in entry:
-            val = entry.get(key)
-
-            if isinstance(val, str):
-                tags.append(parse_tag(val))
-                tags.append(parse_unicode_tag(val))
-            elif isinstance(val, list):
-                tags += [parse_tag(v) for v in val]
-                tags += [parse_unicode_tag(v) for v in val]
-            else:
-                abort('Error: %s\'s key "%s" is not valid (%s)' %
-                    (entry['name'], key, type(val).__name__))
 
-    result = []
-    for tag in tags:
-        if tag not in result:
-            result.append(tag)
+def parse_tags(*sources):
+    """The tags of the values of ``keys`` in ``entry`` for every ``(entry, keys)`` of ``sources``, without duplicates"""
+    # Keys of a dict keep the order tags are first found in
+    tags = {}
+
+    for entry, keys in sources:
+        for key in keys:
+            if key in entry:
+                val = entry.get(key)
+
+                if isinstance(val, str):
+                    tags[normalize_tag(val)] = None
+                elif isinstance(val, list):
+                    for v in val:
+                        tags[normalize_tag(v)] = None
+                else:
+                    abort('Error: %s\'s key "%s" is not valid (%s)' %
+                        (entry['name'], key, type(val).__name__))
 
-    return result
+    return list(tags)
+
+
+GLOBAL_TAGS = ['genres', 'subgenres', 'themes', 'langs', 'platforms']
 
 
 def parse_global_tags(site, item, tag, item_key: str):
@@ -112,15 +201,19 @@ def parse_global_tags(site, item, tag, item_key: str):
         if isinstance(item[tag], str):
             item[tag] = [item[tag]]
 
+        tagObj = getattr(site, tag)
         for t in item[tag]:
-            tagObj = getattr(site, tag, False)
-            if not tagObj.get(t, False):
+            if t not in tagObj:
                 tagObj[t] = {'tag_count': 0, 'keys': set()}
             if item_key not in tagObj[t]['keys']:
                 tagObj[t]['tag_count'] += 1
                 tagObj[t]['keys'].add(item_key)
 
-    setattr(site, tag, OrderedDict(sorted(getattr(site, tag, {}).items())))
+
+def sort_global_tags(site):
+    """Sort the tag tables gathered by parse_global_tags, once every item has been parsed"""
+    for tag in GLOBAL_TAGS:
+        setattr(site, tag, OrderedDict(sorted(getattr(site, tag, {}).items())))
 
 
 def parse_item(entry, entry_tags=[], meta={}, meta_tags=[]):
@@ -130,10 +223,13 @@ def parse_item(entry, entry_tags=[], meta={}, meta_tags=[]):
     added = entry.get('added') or date.min
     if isinstance(added, str):
         added = datetime.strptime(added, "%Y-%m-%d").date()
+    tags = parse_tags((entry, entry_tags), (meta, meta_tags))
+    if 'multiplayer' in entry:
+        tags.append('multiplayer')
     result = dict(entry,
                   new=added == updated and (date.today() - added) < timedelta(days=30),
                   is_updated=(date.today() - updated) < timedelta(days=30),
-                  tags=parse_tags(entry, entry_tags) + parse_tags(meta, meta_tags),
+                  tags=tags,
                   updated=updated)
 
     if "repo" in result:
@@ -194,7 +290,7 @@ def parse_item(entry, entry_tags=[], meta={}, meta_tags=[]):
             result["repoiconstyle"] = "fas"
             result["repotitle"] = "Archive"
 
-    return result
+    return Record(result)
 
 
 def parse_items(site, item, key):
@@ -245,27 +341,89 @@ def show_errors(errors):
     sys.exit(1)
 
 
-def show_validation_errors(data, validation_errors):
+def map_validation_errors(data, validation_errors):
     errors = []
     for error in validation_errors:
-        path = error.path.split('/')
+        if isinstance(error, str):
+            # pykwalify reports unique errors as plain messages
+            error_path = re.search(r"Path: '([^']*)'$", error)[1]
+            message = error
+        else:
+            error_path = error.path
+            message = error.__repr__()
+        path = error_path.split('/')
         game = data[int(path[1])]
         name = game["name"]
 
-        errors.append({"name": name, "error": error.__repr__()})
+        errors.append({"name": name, "error": message})
+
+    return errors
+
+
+def show_validation_errors(data, validation_errors):
+    show_errors(map_validation_errors(data, validation_errors))
 
-    show_errors(errors)
 
+def schema_errors(source_data, schema_file, validator='pykwalify'):
+    if validator == 'compiled':
+        return map_validation_errors(source_data, _validator.load_validator(schema_file)(source_data))
 
-def validate_with_schema(source_data, schema_file):
     core = Core(source_data=source_data, schema_files=[schema_file])
     try:
         core.validate(raise_exception=True)
     except Exception as error:
         if len(core.errors) > 0:
-            show_validation_errors(source_data, core.errors)
+            return map_validation_errors(source_data, core.errors)
         else:
             raise error
+    return []
+
+
+def validate_with_schema(source_data, schema_file, validator='pykwalify'):
+    """Validate a list of games against a schema, with pykwalify or the schema compiled by _validator"""
+    errors = schema_errors(source_data, schema_file, validator)
+    if len(errors) > 0:
+        show_errors(errors)
+
+
+def validate_files(files, schema_file, cache_dir, validator='pykwalify', used=None):
+    """Validate the data of every (path, data) pair in ``files`` against a schema, one file at a time
+
+    Results are cached by the hashes of the file and of the schema, and by validator. Files without a
+    cached result are validated in parallel, then the errors of all files are shown. The paths of the
+    cache entries are added to ``used``, if given.
+    """
+    with open(schema_file, 'rb') as f:
+        schema_digest = hashlib.sha256(f.read()).hexdigest()
+
+    errors = {}
+    pending = {}
+    for path, data in files:
+        with open(path, 'rb') as f:
+            cache_path = op.join(cache_dir, f'{hashlib.sha256(f.read()).hexdigest()}-{schema_digest}-{validator}.pickle')
+        if used is not None:
+            used.add(cache_path)
+        try:
+            with open(cache_path, 'rb') as f:
+                errors[path] = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pending[path] = cache_path
+
+    if len(pending) == 1:
+        path = next(iter(pending))
+        errors[path] = schema_errors(dict(files)[path], schema_file, validator)
+    elif len(pending) > 1:
+        with ProcessPoolExecutor(min(len(pending), os.cpu_count() or 1)) as executor:
+            futures = {path: executor.submit(schema_errors, data, schema_file, validator)
+                       for path, data in files if path in pending}
+            for path, future in futures.items():
+                errors[path] = future.result()
+    for path, cache_path in pending.items():
+        write_cache(cache_path, errors[path])
+
+    all_errors = [error for path, _ in files for error in errors[path]]
+    if len(all_errors) > 0:
+        show_errors(all_errors)
 
 
 def sort_key(game: dict) -> str:
@@ -288,46 +446,159 @@ def sort_key(game: dict) -> str:
     return name
 
 
-def parse_data(site):
-    base = op.dirname(__file__)
+natural_key = natsort_keygen(alg=ns.IGNORECASE)
+
+
+@lru_cache(maxsize=None)
+def name_collation_key(name: str):
+    return natural_key(sort_key({"name": name}))
+
+
+def collation_key(game: dict):
+    """The key games are listed by, computed once per name"""
+    return name_collation_key(game["name"])
+
+
+def first_unsorted(entries: list) -> tuple:
+    """
+    Return the first entry out of place in ``entries`` and the entry that sorting
+    would put there instead, or None if they are sorted
+    """
+    keys = [collation_key(entry) for entry in entries]
+    for j in range(1, len(keys)):
+        if keys[j] < keys[j - 1]:
+            break
+    else:
+        return None
+    # keys[:j] are sorted, so sorting would first change the first of them greater than
+    # the smallest key that comes later, and put the first entry with that key there
+    smallest = min(range(j, len(keys)), key=keys.__getitem__)
+    i = next(i for i in range(j) if keys[i] > keys[smallest])
+    return entries[i], entries[smallest]
+
+
+def write_cache(cache_path, value):
+    os.makedirs(op.dirname(cache_path), exist_ok=True)
+    # Write to a temporary file first so an interrupted build never leaves a truncated entry
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+
+
+# Data of the files loaded by this process, by cache path, when set to a dict, e.g. by render.py --watch:
+# a later parse then only loads the files that changed. parse_data may modify the data it is given, but
+# only in ways that hold for another parse (interned strings, dates parsed)
+loaded_files = None
+
+
+def load_yaml(path, cache_dir, used=None):
+    """
+    Load a YAML file, reusing the cached result of a previous parse of the same content
+
+    The path of the cache entry is added to ``used``, if given.
+    """
+    with open(path, 'rb') as f:
+        content = f.read()
+    digest = hashlib.sha256(yaml.__version__.encode() + content).hexdigest()
+    cache_path = op.join(cache_dir, digest + '.pickle')
+    if used is not None:
+        used.add(cache_path)
+    if loaded_files is not None and cache_path in loaded_files:
+        return loaded_files[cache_path]
+    try:
+        with open(cache_path, 'rb') as f:
+            data = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        data = safe_load(content.decode('utf-8'))
+        write_cache(cache_path, data)
+    if loaded_files is not None:
+        loaded_files[cache_path] = data
+    return data
+
+
+def prune_cache(cache_dirs, used):
+    """Remove the entries of ``cache_dirs`` not in ``used``, e.g. those of earlier versions of the data files"""
+    for cache_dir in cache_dirs:
+        try:
+            names = os.listdir(cache_dir)
+        except FileNotFoundError:
+            continue
+        for name in names:
+            path = op.join(cache_dir, name)
+            if name.endswith('.pickle') and path not in used:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # Pruned by a concurrent build
+                    pass
+
+
+def parse_data(site, base=op.dirname(__file__), validator='pykwalify', profiler=NULL_PROFILER):
+    schema_dir = op.join(op.dirname(__file__), 'schema')
+    cache_dir = op.join(base, '.cache')
+    yaml_cache_dir = op.join(cache_dir, 'yaml')
+    validation_cache_dir = op.join(cache_dir, 'validation')
+    # Cache entries read or written by this build, the others being stale
+    used_cache = set()
     errors = []
 
     originals = []
+    originals_files = []
     for fn in os.listdir(op.join(base, 'originals')):
         if fn.endswith('.yaml'):
-            originals_unsorted = yaml.safe_load(open(op.join(base, 'originals', fn), encoding="utf-8"))
+            path = op.join(base, 'originals', fn)
+            with profiler.phase('parse.yaml'):
+                originals_unsorted = load_yaml(path, yaml_cache_dir, used_cache)
+            originals_files.append((path, originals_unsorted))
             # Check if originals sorted, if not, error out showing the first unsorted entry
-            originals_sorted = natsorted(originals_unsorted, key=sort_key, alg=ns.IGNORECASE)
-            for o1, o2 in zip(originals_unsorted, originals_sorted):
-                if o1["name"] != o2["name"]:
-                    errors.append({
-                        "name": o1["name"],
-                        "error": f"Original game name not sorted correctly in file originals/{fn}: should be '{o2['name']}'"
-                    })
-                    break
-            originals.extend(originals_sorted)
+            profiler.start('parse.sort')
+            unsorted = first_unsorted(originals_unsorted)
+            if unsorted:
+                o1, o2 = unsorted
+                errors.append({
+                    "name": o1["name"],
+                    "error": f"Original game name not sorted correctly in file originals/{fn}: should be '{o2['name']}'"
+                })
+            originals.extend(sorted(originals_unsorted, key=collation_key) if unsorted else originals_unsorted)
+            profiler.stop('parse.sort')
     # Sort originals again for final presentation in the site
-    originals = natsorted(originals, key=sort_key, alg=ns.IGNORECASE)
+    with profiler.phase('parse.sort'):
+        originals.sort(key=collation_key)
     print(str(len(originals)) + ' games in total')
-    validate_with_schema(originals, 'schema/originals.yaml')
+    with profiler.phase('parse.validate'):
+        validate_files(originals_files, op.join(schema_dir, 'originals.yaml'), validation_cache_dir, validator,
+                       used_cache)
 
     clones = []
+    clones_files = []
     for fn in sorted(os.listdir(op.join(base, 'games'))):
         if fn.endswith('.yaml'):
-            clones_unsorted = yaml.safe_load(open(op.join(base, 'games', fn), encoding="utf-8"))
+            path = op.join(base, 'games', fn)
+            with profiler.phase('parse.yaml'):
+                clones_unsorted = load_yaml(path, yaml_cache_dir, used_cache)
+            clones_files.append((path, clones_unsorted))
             # Check if clones sorted, if not, error out showing the first unsorted entry
-            clones_sorted = natsorted(clones_unsorted, key=sort_key, alg=ns.IGNORECASE)
-            for c1, c2 in zip(clones_unsorted, clones_sorted):
-                if c1["name"] != c2["name"]:
-                    errors.append({
-                        "name": c1["name"],
-                        "error": f"Clone game name not sorted correctly in file games/{fn}: should be '{c2['name']}'"
-                    })
-                    break
-            clones.extend(clones_sorted)
+            profiler.start('parse.sort')
+            unsorted = first_unsorted(clones_unsorted)
+            if unsorted:
+                c1, c2 = unsorted
+                errors.append({
+                    "name": c1["name"],
+                    "error": f"Clone game name not sorted correctly in file games/{fn}: should be '{c2['name']}'"
+                })
+            clones.extend(sorted(clones_unsorted, key=collation_key) if unsorted else clones_unsorted)
+            profiler.stop('parse.sort')
     print(str(len(clones)) + ' clones in total')
-    validate_with_schema(clones, 'schema/games.yaml')
-
+    with profiler.phase('parse.validate'):
+        validate_files(clones_files, op.join(schema_dir, 'games.yaml'), validation_cache_dir, validator, used_cache)
+    with profiler.phase('parse.prune'):
+        prune_cache([yaml_cache_dir, validation_cache_dir], used_cache)
+        if loaded_files is not None:
+            for cache_path in loaded_files.keys() - used_cache:
+                del loaded_files[cache_path]
+
+    profiler.start('parse.check')
     site.clones_count = len(clones)
 
     originals_map = {}
@@ -367,7 +638,7 @@ def parse_data(site):
     # - or unique repo + url pair
     clone_names_per_original = {}
     repos_and_urls = set()
-    originals_with_clones = set()
+    clones_per_original = {}
     for clone in clones:
         if 'originals' not in clone:
             show_errors([{
@@ -390,6 +661,7 @@ def parse_data(site):
                 })
             clone_names_per_original[original].add(clone["name"].lower())
 
+        intern_values(clone)
         if isinstance(clone['updated'], str):
             clone['updated'] = datetime.strptime(clone['updated'], "%Y-%m-%d").date()
         if isinstance(clone.get('added'), str):
@@ -430,7 +702,7 @@ def parse_data(site):
             repos_and_urls.add((repo, url))
 
         for original in clone['originals']:
-            originals_with_clones.add(original)
+            clones_per_original.setdefault(original, []).append(clone)
 
         # Multiplayer is inapplicable for tools
         if clone["type"] == "tool" and "multiplayer" in clone:
@@ -451,7 +723,7 @@ def parse_data(site):
 
     # Check for originals with no clones
     for original in originals_map:
-        if original not in originals_with_clones:
+        if original not in clones_per_original:
             errors.append({
                 "name": original,
                 "error": "Original game has no clones"
@@ -459,17 +731,18 @@ def parse_data(site):
 
     if len(errors) > 0:
         show_errors(errors)
+    profiler.stop('parse.check')
 
+    profiler.start('parse.items')
     for item in originals:
-        # Recombine originals and clones
-        combined = copy.deepcopy(item)
-        name = combined["name"]
-
-        combined['games'] = [
-            clone for clone in clones
-            if name in clone['originals']
-        ]
+        # Recombine originals and clones; the originals are not used past this point,
+        # so a shallow copy is enough for parse_items to annotate
+        combined = Record(dict(item, games=clones_per_original[item["name"]]))
         parse_items(site, combined, 'games')
+    sort_global_tags(site)
+    records = [game.item for game in site.games] + [clone for game in site.games for clone in game.clones]
+    size = sum(record.sizeof() for record in records)
+    print(f'{len(records)} records in {size / 2**20:.1f} MB, without the keys and values they share')
     # Deduplicate clones by using a dictionary
     site.new_games = {
         clone['name']: (_names, meta, clone)
@@ -480,3 +753,4 @@ def parse_data(site):
             if clone['is_updated']
         ], key=lambda args: args[2]['updated'], reverse=True)
     }
+    profiler.stop('parse.items')
@@ -0,0 +1,21 @@
+"""
+YAML loading shared by the site build and the maintenance scripts
+
+Uses libyaml's C loader and dumper when PyYAML was built with them, as they
+handle the games database several times faster than the pure-Python ones, and
+falls back to the latter otherwise.
+"""
+import yaml
+
+try:
+    from yaml import CSafeDumper as SafeDumper, CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeDumper, SafeLoader
+
+
+def safe_load(stream):
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def safe_dump(data, stream=None, **kwargs):
+    return yaml.dump(data, stream, Dumper=SafeDumper, **kwargs)
@@ -0,0 +1,97 @@
+"""
+Timings of the phases of a build, for render.py --profile
+
+Every phase records its wall and CPU time, summed over the times it ran, and the
+peak memory of the process when it last ended. Template renders are recorded
+one by one, so the report can show the time spent in every template and the
+slowest pages.
+"""
+import json
+import time
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where peak memory is left out
+    resource = None
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # Kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+class Profiler:
+    def __init__(self):
+        self.started = (time.perf_counter(), time.process_time())
+        self.phases = {}
+        self.running = {}
+        self.renders = []
+
+    def start(self, name):
+        self.running[name] = (time.perf_counter(), time.process_time())
+
+    def stop(self, name):
+        wall, cpu = self.running.pop(name)
+        phase = self.phases.setdefault(name, {'wall': 0.0, 'cpu': 0.0, 'calls': 0})
+        phase['wall'] += time.perf_counter() - wall
+        phase['cpu'] += time.process_time() - cpu
+        phase['calls'] += 1
+        phase['peak_rss_mb'] = peak_rss_mb()
+
+    @contextmanager
+    def phase(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    def record_render(self, template, dst, seconds):
+        self.renders.append((template, dst, seconds))
+
+    def report(self, slowest=10) -> dict:
+        templates = {}
+        for template, _, seconds in self.renders:
+            stats = templates.setdefault(template, {'renders': 0, 'wall': 0.0})
+            stats['renders'] += 1
+            stats['wall'] += seconds
+        return {
+            'total': {
+                'wall': time.perf_counter() - self.started[0],
+                'cpu': time.process_time() - self.started[1],
+                'peak_rss_mb': peak_rss_mb(),
+            },
+            'phases': self.phases,
+            'templates': templates,
+            'slowest_pages': [
+                {'path': dst, 'template': template, 'wall': seconds}
+                for template, dst, seconds in sorted(self.renders, key=lambda render: -render[2])[:slowest]
+            ],
+        }
+
+    def save(self, path, slowest=10):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(slowest), f, indent=2)
+
+
+class NullProfiler:
+    """Stands in for a Profiler when a build is not profiled"""
+
+    def start(self, name):
+        pass
+
+    def stop(self, name):
+        pass
+
+    def phase(self, name):
+        return nullcontext()
+
+    def record_render(self, template, dst, seconds):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
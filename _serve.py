@@ -0,0 +1,97 @@
+"""
+Serve a build locally and reload the pages open in browsers after every rebuild, for render.py --serve
+
+Every HTML page is served with a script listening to /_reload, a stream of
+server-sent events that announces every rebuild.
+"""
+import functools
+import io
+import logging
+import os.path as op
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger(__name__)
+
+RELOAD_PATH = '/_reload'
+RELOAD_SCRIPT = f"<script>new EventSource('{RELOAD_PATH}').onmessage = () => location.reload();</script>".encode()
+KEEPALIVE = 15
+
+
+class Reloader:
+    """Counts rebuilds, for the pages waiting for the next one"""
+
+    def __init__(self):
+        self.version = 0
+        self.condition = threading.Condition()
+
+    def reload(self):
+        with self.condition:
+            self.version += 1
+            self.condition.notify_all()
+
+    def wait(self, version, timeout):
+        with self.condition:
+            self.condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+
+class Handler(SimpleHTTPRequestHandler):
+    def __init__(self, *args, reloader, **kwargs):
+        self.reloader = reloader
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        if self.path == RELOAD_PATH:
+            self.send_events()
+        else:
+            super().do_GET()
+
+    def send_events(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        version = self.reloader.version
+        try:
+            while True:
+                latest = self.reloader.wait(version, KEEPALIVE)
+                self.wfile.write(b'data: reload\n\n' if latest != version else b': keepalive\n\n')
+                self.wfile.flush()
+                version = latest
+        except (BrokenPipeError, ConnectionResetError):
+            # The page was closed or reloaded
+            pass
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if op.isdir(path) and self.path.split('?', 1)[0].endswith('/'):
+            path = op.join(path, 'index.html')
+        if not (path.endswith('.html') and op.isfile(path)):
+            return super().send_head()
+        with open(path, 'rb') as f:
+            content = f.read()
+        end = content.rfind(b'</body>')
+        content = content[:end] + RELOAD_SCRIPT + content[end:] if end >= 0 else content + RELOAD_SCRIPT
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        return io.BytesIO(content)
+
+    def end_headers(self):
+        # Pages change with every rebuild
+        self.send_header('Cache-Control', 'no-store')
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        log.debug(format, *args)
+
+
+def serve(directory, port, reloader) -> ThreadingHTTPServer:
+    """Serve ``directory`` on ``port`` from a background thread"""
+    handler = functools.partial(Handler, directory=directory, reloader=reloader)
+    server = ThreadingHTTPServer(('localhost', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log.info(f'Serving {directory} on http://localhost:{port}/')
+    return server
@@ -0,0 +1,281 @@
+"""
+Compile pykwalify schemas into plain Python validators
+
+pykwalify interprets the schema again for every node it validates. This module
+translates a schema once into Python source, with one function per rule, so
+validating the games database is a matter of calling ordinary functions.
+
+Only the keywords used by the schemas in schema/ are supported; compiling a schema
+using anything else fails rather than silently accepting more documents. Errors
+carry the same paths and messages as pykwalify's, including its quirks (e.g.
+``unique`` is ignored on rules that ``include`` a partial schema).
+
+Print the generated code of a schema with:
+
+    python _validator.py schema/games.yaml
+"""
+import functools
+import re
+import sys
+import time
+from datetime import date
+
+from _loader import safe_load
+
+SUPPORTED_KEYWORDS = {
+    'type', 'desc', 'required', 'enum', 'unique', 'pattern', 'range', 'format',
+    'mapping', 'map', 'sequence', 'seq', 'include',
+}
+
+TYPE_CHECKS = {
+    'str': 'isinstance(value, (str, bytes))',
+    'int': '(isinstance(value, int) and not isinstance(value, bool))',
+    'bool': 'isinstance(value, bool)',
+    'date': 'isinstance(value, (str, date))',
+}
+
+RANGE_CHECKS = [
+    ('max', '{bound} < size', "greater than max limit"),
+    ('min', '{bound} > size', "less than min limit"),
+    ('max-ex', '{bound} <= size', "greater than or equals to max limit(exclusive)"),
+    ('min-ex', '{bound} >= size', "less than or equals to min limit(exclusive)"),
+]
+
+
+class ValidationError:
+    """A validation error, with the path and message pykwalify reports for it"""
+
+    def __init__(self, msg, path):
+        self.msg = msg
+        self.path = path
+
+    def __repr__(self):
+        return self.msg
+
+
+def is_member(value, values):
+    try:
+        return value in values
+    except TypeError:
+        # Unhashable values such as lists are never enum members
+        return False
+
+
+def is_date_string(value, formats):
+    for date_format in formats:
+        try:
+            time.strptime(value, date_format)
+            return True
+        except ValueError:
+            pass
+    return False
+
+
+class SchemaCompiler:
+    def __init__(self, schema: dict):
+        self.root = {k: v for k, v in schema.items() if not k.startswith('schema;')}
+        self.partials = {k.split(';', 1)[1]: v for k, v in schema.items() if k.startswith('schema;')}
+        self.partial_functions = {}
+        self.constants = {}
+        self.lines = []
+        # Key -> rule function tables, emitted once every function is defined
+        self.tables = []
+        self.rules = 0
+
+    def compile(self):
+        root = self.rule(self.root)
+        self.lines += self.tables + [
+            '',
+            'def validate(value):',
+            '    errors = []',
+            f'    {root}(value, "", errors)',
+            '    return errors',
+        ]
+        source = '\n'.join(self.lines) + '\n'
+        namespace = dict(
+            self.constants,
+            ValidationError=ValidationError,
+            is_member=is_member,
+            is_date_string=is_date_string,
+            date=date,
+        )
+        exec(compile(source, '<schema>', 'exec'), namespace)
+        validate = namespace['validate']
+        validate.source = source
+        return validate
+
+    def const(self, value):
+        name = f'_c{len(self.constants)}'
+        self.constants[name] = value
+        return name
+
+    def resolve(self, schema):
+        """The rule actually applied for ``schema``, following includes"""
+        while 'include' in schema:
+            schema = self.partials[schema['include']]
+        return schema
+
+    def partial(self, name):
+        if name not in self.partial_functions:
+            if name not in self.partials:
+                raise ValueError(f"Cannot find partial schema with name '{name}'")
+            self.partial_functions[name] = f'_schema_{re.sub(r"[^0-9A-Za-z_]", "_", name)}_{len(self.partial_functions)}'
+            self.rule(self.partials[name], self.partial_functions[name])
+        return self.partial_functions[name]
+
+    def rule(self, schema, name=None):
+        """Generate the function validating ``schema`` and return its name"""
+        if 'include' in schema:
+            # pykwalify ignores every other keyword of a rule with an include
+            return self.partial(schema['include'])
+        unsupported = set(schema) - SUPPORTED_KEYWORDS
+        if unsupported:
+            raise ValueError(f"Unsupported schema keywords: {', '.join(sorted(unsupported))}")
+
+        if 'sequence' in schema or 'seq' in schema:
+            body = self.sequence(schema)
+        elif 'mapping' in schema or 'map' in schema:
+            body = self.mapping(schema)
+        else:
+            body = self.scalar(schema)
+
+        if schema.get('required'):
+            body = [
+                'if value is None:',
+                '    errors.append(ValidationError(f"required.novalue : \'{path}\'", path))',
+                '    return',
+            ] + body
+
+        if name is None:
+            name = f'_rule{self.rules}'
+            self.rules += 1
+        self.lines += [f'def {name}(value, path, errors):'] + [f'    {line}' for line in body] + ['']
+        return name
+
+    def sequence(self, schema):
+        items = schema.get('sequence', schema.get('seq'))
+        if len(items) != 1:
+            raise ValueError("Only sequences with exactly one item rule are supported")
+        item = items[0]
+        body = [
+            'if value is None:',
+            '    return',
+            'if not isinstance(value, list):',
+            '    shown = value.encode("unicode_escape") if isinstance(value, str) else value',
+            '    errors.append(ValidationError(f"Value \'{shown}\' is not a list. Value path: \'{path}\'", path))',
+            '    return',
+        ]
+        if 'include' not in item and item.get('unique'):
+            body += [
+                'table = {}',
+                'for j, val in enumerate(value):',
+                '    if val is None:',
+                '        continue',
+                '    if val in table:',
+                '        errors.append(ValidationError(',
+                '            f"Value \'{val}\' is not unique. Previous path: \'{path}/{table[val]}\'. Path: \'{path}/{j}\'",',
+                '            f"{path}/{j}"))',
+                '    else:',
+                '        table[val] = j',
+            ]
+        item_function = self.rule(item)
+        body += [
+            'for i, item in enumerate(value):',
+            f'    {item_function}(item, f"{{path}}/{{i}}", errors)',
+        ]
+        return body
+
+    def mapping(self, schema):
+        mapping = schema.get('mapping', schema.get('map'))
+        # Reserve the table before generating the rules of the values, which may add tables of their own
+        index = len(self.tables)
+        table = f'_keys{index}'
+        self.tables.append(None)
+        rules = ', '.join(f'{key!r}: {self.rule(rule)}' for key, rule in mapping.items())
+        self.tables[index] = f'{table} = {{{rules}}}'
+        required = [key for key, rule in mapping.items() if self.resolve(rule).get('required')]
+        body = [
+            'if not isinstance(value, dict):',
+            '    errors.append(ValidationError(f"Value \'{value}\' is not a dict. Value path: \'{path}\'", path))',
+            '    return',
+        ]
+        for key in required:
+            key = self.const(key)
+            body += [
+                f'if {key} not in value:',
+                f'    errors.append(ValidationError(f"Cannot find required key \'{{{key}}}\'. Path: \'{{path}}\'", path))',
+            ]
+        body += [
+            'for key, val in value.items():',
+            f'    rule = {table}.get(key)',
+            '    if rule is None:',
+            '        errors.append(ValidationError(f"Key \'{key}\' was not defined. Path: \'{path}\'", path))',
+            '    else:',
+            '        rule(val, f"{path}/{key}", errors)',
+        ]
+        return body
+
+    def scalar(self, schema):
+        type_ = schema.get('type', 'str')
+        if type_ not in TYPE_CHECKS:
+            raise ValueError(f"Unsupported scalar type '{type_}'")
+        body = [
+            'if value is None:',
+            '    return',
+        ]
+        if 'enum' in schema:
+            members, shown = self.const(frozenset(schema['enum'])), self.const(repr(schema['enum']))
+            body += [
+                f'if not is_member(value, {members}):',
+                f'    errors.append(ValidationError(f"Enum \'{{value}}\' does not exist. Path: \'{{path}}\' Enum: {{{shown}}}", path))',
+            ]
+        body += [
+            f'if not {TYPE_CHECKS[type_]}:',
+            f'    errors.append(ValidationError(f"Value \'{{value}}\' is not of type \'{type_}\'. Path: \'{{path}}\'", path))',
+            '    return',
+        ]
+        if 'pattern' in schema:
+            pattern, shown = self.const(re.compile(schema['pattern'], re.UNICODE)), self.const(schema['pattern'])
+            body += [
+                f'if not isinstance(value, str) or {pattern}.match(value) is None:',
+                f'    errors.append(ValidationError(f"Value \'{{value}}\' does not match pattern \'{{{shown}}}\'. Path: \'{{path}}\'", path))',
+            ]
+        if 'range' in schema:
+            body += [
+                'try:',
+                '    size = len(value)',
+                'except TypeError:',
+                '    size = value',
+            ]
+            for keyword, check, text in RANGE_CHECKS:
+                if keyword in schema['range']:
+                    bound = schema['range'][keyword]
+                    body += [
+                        f'if {check.format(bound=repr(bound))}:',
+                        f'    errors.append(ValidationError(f"Type \'scalar\' has size of \'{{size}}\', {text} \'{bound}\'. Path: \'{{path}}\'", path))',
+                    ]
+        if type_ == 'date':
+            formats = schema.get('format')
+            if not formats:
+                raise ValueError("Dates are only supported with a format")
+            formats = [formats] if isinstance(formats, str) else formats
+            body += [
+                f'if isinstance(value, str) and not is_date_string(value, {self.const(formats)}):',
+                f'    errors.append(ValidationError(f"Not a valid date: {{value}} format: {{{self.const(formats[-1])}}}. Path: \'{{path}}\'", path))',
+            ]
+        return body
+
+
+def compile_schema(schema: dict):
+    """Return a function validating a document against ``schema`` and returning its errors"""
+    return SchemaCompiler(schema).compile()
+
+
+@functools.lru_cache(None)
+def load_validator(schema_file):
+    with open(schema_file, encoding='utf-8') as f:
+        return compile_schema(safe_load(f))
+
+
+if __name__ == '__main__':
+    print(load_validator(sys.argv[1]).source)
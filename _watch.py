@@ -0,0 +1,102 @@
+"""
+Wait for changes to the files directly in directories, for render.py --watch
+
+On Linux the kernel tells about changes through inotify, used through ctypes to
+do without another dependency. Elsewhere the directories are polled for changed
+modification times.
+"""
+import ctypes
+import ctypes.util
+import os
+import os.path as op
+import select
+import struct
+import time
+
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT = struct.Struct('iIII')
+
+# Editors save with bursts of events, gathered into one change
+SETTLE = 0.1
+
+
+class InotifyWatcher:
+    def __init__(self, paths):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.dirs = {}
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        for path in paths:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f'Cannot watch {path}')
+            self.dirs[wd] = path
+
+    def read(self):
+        changed = set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset < len(data):
+            wd, _, _, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0')
+            offset += EVENT.size + length
+            if wd in self.dirs:
+                changed.add(op.join(self.dirs[wd], os.fsdecode(name)))
+        return changed
+
+    def wait(self) -> set:
+        """Block until files change, and return their paths"""
+        changed = set()
+        while not changed:
+            select.select([self.fd], [], [])
+            changed |= self.read()
+        while select.select([self.fd], [], [], SETTLE)[0]:
+            changed |= self.read()
+        return changed
+
+
+class PollingWatcher:
+    def __init__(self, paths, interval=0.5):
+        self.paths = paths
+        self.interval = interval
+        self.mtimes = self.scan()
+
+    def scan(self):
+        mtimes = {}
+        for path in self.paths:
+            for entry in os.scandir(path):
+                if entry.is_file():
+                    mtimes[entry.path] = entry.stat().st_mtime_ns
+        return mtimes
+
+    def wait(self) -> set:
+        """Block until files change, and return their paths"""
+        while True:
+            time.sleep(self.interval)
+            mtimes = self.scan()
+            changed = {path for path in mtimes.keys() | self.mtimes.keys()
+                       if mtimes.get(path) != self.mtimes.get(path)}
+            self.mtimes = mtimes
+            if changed:
+                return changed
+
+
+def watcher(paths):
+    """A watcher of the files in the directories ``paths``, with inotify where available"""
+    try:
+        return InotifyWatcher(paths)
+    except (OSError, AttributeError):
+        # No inotify, or no libc with it
+        return PollingWatcher(paths)
@@ -1,23 +1,36 @@
 #!/usr/bin/env python
 
-import html
+import hashlib
 import json
+import filecmp
 import os, os.path as op
 import shutil
+import threading
 import functools
 import argparse
+import cProfile
 import logging
+import time
+from collections import defaultdict
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
 from pathlib import Path
 
 import markupsafe
 import unidecode
 
 import jinja2
+import jinja2.meta
 from pykwalify_webform.renderer import Renderer
 from slugify import slugify
-from yaml import safe_load
-
+import _compress
 import _ext
+import _profile
+import _serve
+import _validator
+import _watch
+from _loader import safe_load
 
 HERE = Path(__file__).parent
 
@@ -27,105 +40,573 @@ log = logging.getLogger()
 
 
 DIR = op.dirname(__file__)
+# Manifests of incremental builds, kept out of the target directory which is published as is
+MANIFEST_DIR = op.join(DIR, '.cache', 'manifests')
+# Where earlier builds kept their manifest
+LEGACY_MANIFEST = '.manifest.json'
+# Compiled templates, reused by later builds while their source is unchanged; None to compile them every time
+TEMPLATE_CACHE = op.join(DIR, '.cache', 'jinja')
+
+# Records the phases of the build and the render of every page with --profile
+profiler = _profile.NULL_PROFILER
 
 
 class Site:
     pass
 
 
+class Manifest:
+    """Digests of the inputs every output file was rendered from
+
+    In incremental mode the manifest of the previous build to the same target
+    directory is loaded, so outputs whose inputs did not change can be skipped.
+    """
+
+    def __init__(self, target, incremental=False):
+        self.target = target
+        name = hashlib.sha256(op.abspath(target).encode('utf-8')).hexdigest()[:16]
+        self.path = op.join(MANIFEST_DIR, f'{name}.json')
+        self.previous = {}
+        self.current = {}
+        if incremental and op.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                self.previous = json.load(f)
+
+    def is_fresh(self, dst, *inputs):
+        """Record the digest of ``inputs`` for ``dst`` and tell if ``dst`` was already built from them"""
+        key = op.relpath(dst, self.target)
+        self.current[key] = digest(*inputs)
+        return self.previous.get(key) == self.current[key] and op.exists(dst)
+
+    def add_copy(self, dst):
+        """Record ``dst`` as copied from a source directory, so that it is removed once its source is"""
+        self.current[op.relpath(dst, self.target)] = None
+
+    def save(self):
+        # Whatever the previous build wrote but this one did not is stale
+        for key in sorted(self.previous.keys() - self.current.keys()):
+            remove_output(op.join(self.target, key))
+        if op.exists(op.join(self.target, LEGACY_MANIFEST)):
+            remove_output(op.join(self.target, LEGACY_MANIFEST))
+        os.makedirs(MANIFEST_DIR, exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(self.current, f, indent=2, sort_keys=True)
+
+
 @functools.lru_cache(10)
 def env():
-    return jinja2.Environment(loader=jinja2.FileSystemLoader(DIR))
+    bytecode_cache = None
+    if TEMPLATE_CACHE:
+        # Entries are checked against the checksum of the template source, and written atomically
+        # so that the processes of render_games can share them
+        os.makedirs(TEMPLATE_CACHE, exist_ok=True)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(TEMPLATE_CACHE)
+    e = jinja2.Environment(loader=jinja2.FileSystemLoader(DIR), bytecode_cache=bytecode_cache)
+    e.filters['slugify'] = slugify
+    e.filters['e'] = markupsafe.escape
+    return e
 
 
 @functools.lru_cache(10)
-def ctx():
+def ctx(validator='pykwalify', base=DIR):
     site = Site()
-    _ext.parse_data(site)
+    _ext.parse_data(site, base, validator=validator, profiler=profiler)
     return site
 
 
+def json_default(value):
+    """Records of the games database as objects, and anything else json cannot encode, e.g. dates, as strings"""
+    if isinstance(value, _ext.Record):
+        return value.as_dict()
+    return str(value)
+
+
+def digest(*inputs):
+    h = hashlib.sha256()
+    for value in inputs:
+        h.update(json.dumps(value, sort_keys=True, default=json_default).encode('utf-8'))
+    return h.hexdigest()
+
+
+@functools.lru_cache(None)
+def template_digest(name):
+    """Digest of a template's source and of every template it imports or includes"""
+    source, _, _ = env().loader.get_source(env(), name)
+    h = hashlib.sha256(source.encode('utf-8'))
+    for ref in sorted(jinja2.meta.find_referenced_templates(env().parse(source))):
+        h.update(template_digest(ref).encode('ascii'))
+    return h.hexdigest()
+
+
+def write_file(dst, content):
+    """Write ``content`` to ``dst`` unless it already holds exactly that, keeping its mtime"""
+    try:
+        with open(dst, encoding='utf-8', newline='') as f:
+            if f.read() == content:
+                return
+    except OSError:
+        pass
+    os.makedirs(op.dirname(dst), exist_ok=True)
+    with open(dst, 'w', encoding='utf-8', newline='') as f:
+        f.write(content)
+
+
+def remove_output(path):
+    log.info(f'Removing stale {path}')
+    try:
+        os.remove(path)
+        os.removedirs(op.dirname(path))
+    except OSError:
+        # Parent directory still holds other outputs
+        pass
+
+
 def render_to(src, dst, **ctx):
     t = env().get_template(src)
 
     log.info(f'Rendering {src} -> {dst}')
+    start = time.perf_counter()
     res = t.render(**ctx)
 
-    os.makedirs(op.dirname(dst), exist_ok=True)
-    with open(dst, 'w', encoding='utf-8') as f:
-        f.write(res)
+    write_file(dst, res)
+    profiler.record_render(src, dst, time.perf_counter() - start)
+
+
+def copy_if_changed(src, dst):
+    if op.exists(dst) and filecmp.cmp(src, dst, shallow=False):
+        return dst
+    return shutil.copy2(src, dst)
 
 
 def copy_to(src, dst):
+    """Copy the directory ``src`` to ``dst``, leaving unchanged files as they are, and return the files of ``dst``"""
     log.info(f'Copying {src} -> {dst}')
-    shutil.copytree(src, dst)
+    paths = []
 
+    def copy(src, dst):
+        paths.append(dst)
+        return copy_if_changed(src, dst)
 
-def render_all(target):
-    if op.exists(target):
-        shutil.rmtree(target)
+    shutil.copytree(src, dst, copy_function=copy, dirs_exist_ok=True)
+    return paths
+
+
+def nav_inputs(site):
+    """Site-wide values shown on every page through the navigation bar"""
+    return [
+        site.clones_count,
+        {key: {tag: props['tag_count'] for tag, props in getattr(site, key).items()}
+         for key in ('langs', 'genres', 'subgenres', 'themes')},
+    ]
+
+
+def game_inputs(game):
+    return [game.item, game.meta, game.clones]
 
-    copy_to('static', target + '/static')
 
-    site = ctx()
-    render_to('index.html', f'{target}/index.html', site=site)
+def render_game(target, site, game):
+    render_to(
+        'game.html',
+        f'{target}/{game.slug}/index.html',
+        site=site,
+        game=game,
+        title=f"{game.names[0]} clones - OSGC",
+        description=f"List of open source clones and remakes for {game.names[0]}"
+    )
+
+
+# Site being rendered by this process when it is a worker of render_games
+worker_site = None
+
+
+def init_worker(site, profiling=False):
+    # Every worker compiles templates in its own environment
+    env.cache_clear()
+    global worker_site, profiler
+    worker_site = site
+    profiler = _profile.Profiler() if profiling else _profile.NULL_PROFILER
+
+
+def render_shard(target, indexes):
+    for i in indexes:
+        render_game(target, worker_site, worker_site.games[i])
+    # Renders timed by this worker, sent back to the profiler of the build
+    if isinstance(profiler, _profile.Profiler):
+        renders, profiler.renders = profiler.renders, []
+        return renders
+    return []
+
+
+def render_games(target, site, games, jobs=1):
+    if jobs <= 1 or len(games) <= 1:
+        for game in games:
+            render_game(target, site, game)
+        return
+
+    # Games are sent to workers by their position in site.games, dealt round-robin so shards stay balanced
+    positions = {id(game): i for i, game in enumerate(site.games)}
+    indexes = [positions[id(game)] for game in games]
+    shards = [indexes[i::jobs] for i in range(jobs)]
+    profiling = isinstance(profiler, _profile.Profiler)
+    with ProcessPoolExecutor(jobs, initializer=init_worker, initargs=(site, profiling)) as executor:
+        for renders in executor.map(render_shard, [target] * len(shards), shards):
+            for render in renders:
+                profiler.record_render(*render)
+
+
+def show_id(name):
+    """The id of the first name of a game in the list, as the show_id macro renders it"""
+    return name.lower().replace(' ', '-')
+
+
+def flatten(names):
+    for name in names:
+        if isinstance(name, str):
+            yield name
+        else:
+            yield from name
+
+
+def search_keywords(clone, names, meta):
+    """The text a clone is searched by, from its own fields and the names of its original"""
+    keywords = [clone['name'], *clone['tags'], clone.get('info') or '']
+    if clone['new']:
+        keywords.append('new updated added')
+    if 'multiplayer' in clone:
+        keywords.append('multiplayer')
+    keywords += flatten(names)
+    keywords += flatten(meta['names_ascii'])
+    return unidecode.unidecode(' '.join(keywords).lower())
+
+
+def search_tokens(text):
+    # main.js looks for search terms within every token, so words such as "point-and-click" are also found
+    # by their parts
+    return set(text.split())
+
+
+def bit_runs(ids):
+    """The lengths of the alternating runs of unset and set bits of the bitset holding ``ids``"""
+    runs = []
+    end = 0
+    for id in sorted(ids):
+        if runs and id == end:
+            runs[-1] += 1
+        else:
+            runs += [id - end, 1]
+        end = id + 1
+    return runs
+
+
+def search_index(games):
+    """
+    An inverted index of every clone in the list of games, searched by main.js
+
+    Entries are the data-parent and data-name attributes of the clones, ids their
+    positions. main.js scans the sorted tokens for those containing a search term,
+    as the substring match of the former filter did, and each token has the gaps
+    between its sorted ids.
+
+    Tags have the bitset of the ids of their clones, to filter by tags and count
+    the games of each tag with bitwise operations. A clone may be listed under
+    several originals, with their tags: ``single`` is the bitset of the clones
+    listed once, and ``shared`` has the ids of every other clone.
+    """
+    entries = {}
+    postings = defaultdict(set)
+    tags = defaultdict(set)
+    listings = defaultdict(set)
+    for game in games:
+        parent = show_id(game.names[0])
+        for clone in game.clones:
+            id = entries.setdefault((parent, clone['name']), len(entries))
+            listings[clone['name']].add(id)
+            for token in search_tokens(search_keywords(clone, game.names, game.meta)):
+                postings[token].add(id)
+            for tag in clone['tags']:
+                tags[tag].add(id)
+    tokens = sorted(postings)
+    gaps = []
+    for token in tokens:
+        ids = sorted(postings[token])
+        gaps.append([ids[0]] + [b - a for a, b in zip(ids, ids[1:])])
+    return {
+        'entries': [list(entry) for entry in entries],
+        'tokens': tokens,
+        'postings': gaps,
+        'tags': {tag: bit_runs(ids) for tag, ids in sorted(tags.items())},
+        'single': bit_runs(min(ids) for ids in listings.values() if len(ids) == 1),
+        'shared': [sorted(ids) for ids in listings.values() if len(ids) > 1],
+    }
+
+
+def index_shards(games, size):
+    """Split the list of games of the index into consecutive shards of ``size`` games"""
+    return [
+        {
+            'src': f'/_index/{i // size}.html',
+            'games': games[i:i + size],
+            # Lines taken by the shard once loaded, to reserve its space in the index
+            'rows': sum(len(game.names) + len(game.clones) for game in games[i:i + size]),
+        }
+        for i in range(0, len(games), size)
+    ]
+
+
+def render_all(target, incremental=False, jobs=1, validator='pykwalify', compact_data=False, bundle_clones=False,
+               index_shard_size=0, base=DIR, site=None):
+    """Render the site from the games database under ``base``, or from ``site`` when already parsed"""
+    profiler.start('static')
+    if op.exists(target) and not incremental:
+        shutil.rmtree(target)
+    manifest = Manifest(target, incremental)
+
+    # Recorded so that files removed from the sources are removed from an incremental build
+    for path in [*copy_to('static', target + '/static'),
+                 *copy_to(str(HERE / "templates/forms/static"), f"{target}/_add_form")]:
+        manifest.add_copy(path)
+    profiler.stop('static')
+
+    if site is None:
+        with profiler.phase('parse'):
+            site = ctx(validator, base)
+    profiler.start('index')
+    nav = nav_inputs(site)
+    shards = index_shards(site.games, index_shard_size) if index_shard_size else []
+    dst = f'{target}/index.html'
+    if not manifest.is_fresh(dst, template_digest('index.html'), nav, index_shard_size,
+                             [game_inputs(game) for game in site.games], list(site.new_games.values())):
+        render_to('index.html', dst, site=site, shards=shards)
+    profiler.stop('index')
+    profiler.start('search')
+    dst = f'{target}/search.json'
+    index = search_index(site.games)
+    if not manifest.is_fresh(dst, index):
+        log.info(f'Rendering {dst}')
+        write_file(dst, json.dumps(index, separators=(',', ':')))
+    profiler.stop('search')
+    profiler.start('shards')
+    for shard in shards:
+        dst = target + shard['src']
+        if not manifest.is_fresh(dst, template_digest('index_shard.html'), [game_inputs(game) for game in shard['games']]):
+            render_to('index_shard.html', dst, site=site, shard=shard)
+    profiler.stop('shards')
+    profiler.start('feed')
     if site.new_games:
         updated = max(game['updated'] for names, meta, game in site.new_games.values())
-        render_to('feed.xml', f'{target}/feed.xml', site=site, updated=updated)
+        dst = f'{target}/feed.xml'
+        if not manifest.is_fresh(dst, template_digest('feed.xml'), list(site.new_games.values())):
+            render_to('feed.xml', dst, site=site, updated=updated)
+    profiler.stop('feed')
+    profiler.start('pages')
+    # Games whose slugs clash share a page, which shows the last of them; each output is written once per build
+    pages = {}
     for game in site.games:
-        render_to(
-            'game.html',
-            f'{target}/{game.slug}/index.html',
-            site=site,
-            game=game,
-            title=f"{game.names[0]} clones - OSGC",
-            description=f"List of open source clones and remakes for {game.names[0]}"
-        )
-        render_data(f"{target}/{game.slug}/data.json", game.item)
+        if game.slug in pages:
+            log.warning(f'{pages[game.slug].names[0]} and {game.names[0]} share the page {game.slug}/, '
+                        f'which shows the latter')
+        pages[game.slug] = game
+    pending = []
+    for game in pages.values():
+        dst = f'{target}/{game.slug}/index.html'
+        if not manifest.is_fresh(dst, template_digest('game.html'), nav, game_inputs(game)):
+            pending.append(game)
+        dst = f"{target}/{game.slug}/data.json"
+        if not manifest.is_fresh(dst, game.item, compact_data):
+            render_data(dst, game.item, compact_data)
+    render_games(target, site, pending, jobs)
+    profiler.stop('pages')
+    profiler.start('data')
     # Render data for edit game/clone forms
     clones = {clone["name"]: clone for game in site.games for clone in game.clones}
-    for name, clone in clones.items():
-        render_data(f"{target}/_clones/{slugify(name)}.json", clone)
-
-
-def normalize(text):
-    if not text:
-        return ''
-    return html.escape(unidecode.unidecode(text.lower()))
+    if bundle_clones:
+        dst, index_dst = f"{target}/_clones/clones.ndjson", f"{target}/_clones/index.json"
+        # Both files are recorded, so that neither is removed as stale
+        fresh = [manifest.is_fresh(path, list(clones.values())) for path in (dst, index_dst)]
+        if not all(fresh):
+            render_bundle(dst, index_dst, clones.values())
+    else:
+        # Names with the same slug share a file, which holds the last of them
+        for slug, clone in {slugify(name): clone for name, clone in clones.items()}.items():
+            dst = f"{target}/_clones/{slug}.json"
+            if not manifest.is_fresh(dst, clone, compact_data):
+                render_data(dst, clone, compact_data)
+    profiler.stop('data')
+    with profiler.phase('manifest'):
+        manifest.save()
+    return site
 
 
-def render_game_form(schema: str, out_path: str, form_name: str, value=None):
+def render_game_form(schema: str, out_path: str, form_name: str, value=None, clones_bundle=False):
     log.info(f"Rendering game form {schema=} -> {out_path}")
     with open(schema) as f:
         schemata = safe_load(f)
     renderer = Renderer(schemata, HERE / "templates/forms")
-    os.makedirs(os.path.dirname(out_path), exist_ok=True)
-    with open(out_path, "w") as f:
-        f.write(renderer.render("", name=form_name, value=value, static_url="/_add_form"))
+    write_file(out_path, renderer.render("", name=form_name, value=value, static_url="/_add_form",
+                                         clones_bundle=clones_bundle))
 
 
-def render_data(out_path: str, value):
-    Path(out_path).parent.mkdir(parents=True, exist_ok=True)
-    with open(out_path, "w") as f:
-        json.dump(value, f, indent=2, default=str)
+def jsonable(value):
+    """``value`` with records as dicts and dates in ISO format, the only non-JSON values of the games database"""
+    if isinstance(value, Mapping):
+        return {k: jsonable(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [jsonable(v) for v in value]
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def dump_compact(value):
+    return json.dumps(jsonable(value), separators=(',', ':'))
+
+
+def render_data(out_path: str, value, compact=False):
+    if compact:
+        write_file(out_path, dump_compact(value))
+    else:
+        write_file(out_path, json.dumps(value, indent=2, default=json_default))
+
+
+def render_bundle(out_path: str, index_path: str, values):
+    """
+    Write ``values`` as one compact JSON document per line of ``out_path``, and the
+    byte offset and length of every line by slug of its name to ``index_path``
+
+    The edit form fetches the line of a single clone with an HTTP range request.
+    """
+    log.info(f'Rendering {out_path}')
+    os.makedirs(op.dirname(out_path), exist_ok=True)
+    index = {}
+    offset = 0
+    with open(out_path, 'wb') as f:
+        for value in values:
+            line = dump_compact(value).encode('utf-8')
+            index[slugify(value['name'])] = [offset, len(line)]
+            f.write(line + b'\n')
+            offset += len(line) + 1
+    write_file(index_path, json.dumps(index, separators=(',', ':')))
 
 
 def main():
     parser = argparse.ArgumentParser(description='Render OSGC')
     parser.add_argument('-d', '--dest', default='_build')
+    parser.add_argument('--data', default=DIR, metavar='DIR',
+                        help='directory holding the originals/ and games/ to render')
+    parser.add_argument('--incremental', action='store_true',
+                        help='keep the previous build and only re-render outputs whose inputs changed')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='number of worker processes rendering game pages')
+    parser.add_argument('--validator', choices=_ext.VALIDATORS, default='pykwalify',
+                        help='validate the games database with pykwalify, or with the schemas compiled to Python')
+    parser.add_argument('--compact-data', action='store_true',
+                        help='write the JSON data of the edit forms without indentation')
+    parser.add_argument('--bundle-clones', action='store_true',
+                        help='write the data of all clones to a single _clones/clones.ndjson with a byte offset index')
+    parser.add_argument('--index-shard-size', type=int, default=0, metavar='N',
+                        help='split the list of games of the index into shards of N games loaded on demand')
+    parser.add_argument('--profile', metavar='REPORT',
+                        help='write the time and memory taken by every phase of the build to REPORT as JSON')
+    parser.add_argument('--profile-slowest', type=int, default=10, metavar='N',
+                        help='number of slowest pages listed in the profile report')
+    parser.add_argument('--cprofile', metavar='FILE',
+                        help='run the build under cProfile and write its stats to FILE, e.g. for snakeviz')
+    parser.add_argument('--precompress', action='store_true',
+                        help='write .gz siblings of every text file of the build, for nginx to serve as is')
+    parser.add_argument('--watch', action='store_true',
+                        help='rebuild whenever the games database, templates or static files change')
+    parser.add_argument('--serve', action='store_true',
+                        help='serve the build on localhost, reloading pages in the browser after every rebuild')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='port to serve the build on')
     args = parser.parse_args()
 
-    env().filters['normalize'] = normalize
-    env().filters['slugify'] = slugify
-    env().filters['e'] = markupsafe.escape
-    render_all(args.dest)
+    global profiler
+    if args.profile:
+        profiler = _profile.Profiler()
+    if args.cprofile:
+        cprofiler = cProfile.Profile()
+        cprofiler.enable()
+
+    if args.watch:
+        # Kept for the rebuilds of watch
+        _ext.loaded_files = {}
+    site = build(args, args.incremental)
+
+    if args.cprofile:
+        cprofiler.disable()
+        cprofiler.dump_stats(args.cprofile)
+    if args.profile:
+        profiler.save(args.profile, args.profile_slowest)
+        log.info(f'Wrote profile to {args.profile}')
+
+    reloader = _serve.Reloader()
+    if args.serve:
+        _serve.serve(args.dest, args.port, reloader)
+    try:
+        if args.watch:
+            watch(args, site, reloader)
+        elif args.serve:
+            threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+def build(args, incremental, site=None):
+    site = render_all(args.dest, incremental, args.jobs, args.validator, args.compact_data, args.bundle_clones,
+                      args.index_shard_size, args.data, site)
+
+    with profiler.phase('forms'):
+        # Render add game forms
+        render_game_form("schema/games.yaml", f"{args.dest}/add_game.html", "Add Game", clones_bundle=args.bundle_clones)
+        render_game_form("schema/originals.yaml", f"{args.dest}/add_original.html", "Add Original")
+
+    if args.precompress:
+        with profiler.phase('precompress'):
+            _compress.precompress(args.dest)
+    return site
 
-    # Render add game forms
-    render_game_form("schema/games.yaml", f"{args.dest}/add_game.html", "Add Game")
-    render_game_form("schema/originals.yaml", f"{args.dest}/add_original.html", "Add Original")
 
-    # Copy static files
-    shutil.copytree(str(HERE / "templates/forms/static"), f"{args.dest}/_add_form")
+def watch(args, site, reloader):
+    """
+    Rebuild incrementally after every change, reusing the parsed site unless the games database or its schema
+    changed
+
+    The data of the files loaded are kept in memory, and the validation cache of parse_data
+    holds the results of the others, so a re-parse only loads and validates the changed
+    files; the checks across files and the games are still made from all of them. The
+    manifest only re-renders the pages of changed games.
+    """
+    data = [op.join(args.data, 'originals'), op.join(args.data, 'games'), op.join(DIR, 'schema')]
+    templates = [dirpath for dirpath, _, _ in os.walk(op.join(DIR, 'templates'))]
+    # Page templates are at the top of the project
+    watcher = _watch.watcher([*data, DIR, *templates, op.join(DIR, 'static')])
+    log.info('Watching for changes')
+    while True:
+        changed = {path for path in watcher.wait()
+                   if path.endswith(('.yaml', '.html', '.xml', '.jinja2', '.js', '.css'))}
+        if not changed:
+            continue
+        log.info(f'Changed: {", ".join(sorted(op.relpath(path) for path in changed))}')
+        if any(op.dirname(path) in data for path in changed):
+            ctx.cache_clear()
+            # Schemas are compiled once per process
+            _validator.load_validator.cache_clear()
+            site = None
+        template_digest.cache_clear()
+        env.cache_clear()
+        start = time.perf_counter()
+        try:
+            site = build(args, True, site)
+        except SystemExit:
+            # Invalid games are reported by parse_data, which exits; keep watching for their fix
+            log.error('Build failed, waiting for changes')
+            continue
+        except Exception:
+            log.exception('Build failed, waiting for changes')
+            continue
+        log.info(f'Rebuilt in {time.perf_counter() - start:.2f}s')
+        reloader.reload()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,73 @@
+"""
+Measure how a full build scales with the size of the games database
+
+Run from the project root:
+
+    python -m scripts.bench_build 1 5 20
+
+For every factor a synthetic database of that many copies of the real one is
+generated, then built from scratch by render.py --profile in a process of its
+own, so that its peak memory is its own. The scaling exponent compares every
+build with the previous one: about 1 means the build grows linearly with the
+database, 2 that something went quadratic.
+"""
+import argparse
+import json
+import math
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from scripts.synthetic import generate
+from scripts.utils import PROJECT_ROOT_PATH
+
+PHASES = ["parse", "index", "search", "pages", "data"]
+
+
+def build(data: Path, dest: Path, args) -> dict:
+    report = dest.parent / f"{dest.name}.json"
+    subprocess.run(
+        [
+            sys.executable, str(PROJECT_ROOT_PATH / "render.py"),
+            "--dest", str(dest), "--data", str(data), "--profile", str(report),
+            "--jobs", str(args.jobs), "--validator", args.validator,
+        ],
+        cwd=PROJECT_ROOT_PATH, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    return json.loads(report.read_text())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("factors", nargs="*", type=int, default=[1, 5, 20])
+    parser.add_argument("-j", "--jobs", type=int, default=1)
+    parser.add_argument("--validator", default="pykwalify")
+    args = parser.parse_args()
+
+    print(
+        f"{'factor':>6} {'clones':>7} {'pages':>6} {'wall (s)':>9} {'cpu (s)':>8} {'peak (MB)':>9} "
+        f"{'clones/s':>9} {'scaling':>7}  " + " ".join(f"{phase:>7}" for phase in PHASES)
+    )
+    previous = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for factor in args.factors:
+            data = Path(tmp) / f"x{factor}"
+            clones = generate(data, factor)["games"]
+            report = build(data, Path(tmp) / f"build{factor}", args)
+            total = report["total"]
+            pages = report["templates"].get("game.html", {}).get("renders", 0)
+            scaling = (
+                f"{math.log(total['wall'] / previous[1]) / math.log(factor / previous[0]):>7.2f}"
+                if previous and factor != previous[0] else f"{'':>7}"
+            )
+            phases = " ".join(f"{report['phases'].get(phase, {}).get('wall', 0):>7.1f}" for phase in PHASES)
+            print(
+                f"{factor:>6} {clones:>7} {pages:>6} {total['wall']:>9.1f} {total['cpu']:>8.1f} "
+                f"{total['peak_rss_mb'] or 0:>9.0f} {clones / total['wall']:>9.0f} {scaling}  {phases}"
+            )
+            previous = factor, total["wall"]
+
+
+if __name__ == "__main__":
+    main()
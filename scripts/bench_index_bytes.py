@@ -0,0 +1,44 @@
+"""
+Measure how many bytes a first view of the index transfers
+
+Run from the project root on one or more builds, e.g. a default one and one with
+a sharded index:
+
+    python render.py -d _build
+    python render.py -d _build_sharded --index-shard-size 100
+    python -m scripts.bench_index_bytes _build _build_sharded
+
+A first view fetches the index, the site's own CSS and JavaScript and, when the
+index is sharded, the first shard of games. External assets (fonts, CDN scripts)
+are the same for every build and left out. Sizes are given as stored and as
+gzip-compressed on the wire.
+"""
+import argparse
+import gzip
+from pathlib import Path
+
+
+def first_view(build: Path) -> list[Path]:
+    files = [build / "index.html", build / "static" / "main.css", build / "static" / "main.js"]
+    first_shard = build / "_index" / "0.html"
+    if first_shard.exists():
+        files.append(first_shard)
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("builds", nargs="+", type=Path)
+    args = parser.parse_args()
+
+    print(f"{'build':<24} {'files':>5} {'raw (KiB)':>10} {'gzip (KiB)':>10}")
+    for build in args.builds:
+        files = first_view(build)
+        contents = [path.read_bytes() for path in files]
+        raw = sum(len(content) for content in contents)
+        compressed = sum(len(gzip.compress(content, 6)) for content in contents)
+        print(f"{str(build):<24} {len(files):>5} {raw / 1024:>10.1f} {compressed / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
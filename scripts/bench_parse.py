@@ -0,0 +1,44 @@
+"""
+Measure how _ext.parse_data scales with the size of the games database
+
+Run from the project root:
+
+    python -m scripts.bench_parse 1 2 4 8
+
+For every factor a synthetic database of that many copies of the real one is
+generated, then parsed twice: once cold and once with the YAML cache warm.
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import _ext
+from scripts.synthetic import generate
+
+
+def timed_parse(base: Path) -> tuple[float, SimpleNamespace]:
+    site = SimpleNamespace()
+    start = time.perf_counter()
+    _ext.parse_data(site, str(base))
+    return time.perf_counter() - start, site
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("factors", nargs="*", type=int, default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    print(f"{'factor':>6} {'originals':>9} {'clones':>7} {'cold (s)':>9} {'warm (s)':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for factor in args.factors:
+            base = Path(tmp) / f"x{factor}"
+            generate(base, factor)
+            cold, _ = timed_parse(base)
+            warm, site = timed_parse(base)
+            print(f"{factor:>6} {len(site.games):>9} {site.clones_count:>7} {cold:>9.2f} {warm:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
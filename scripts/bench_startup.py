@@ -0,0 +1,64 @@
+"""
+Measure how long render.py takes to start, with and without its template cache
+
+Run from the project root:
+
+    python -m scripts.bench_startup --runs 10
+
+Every run is a process of its own, which imports render.py and loads the
+templates of the site, as a build does before rendering its first page. Without
+the cache every template is compiled; with it, a cache filled by a previous run
+is read back. The median of the runs is reported.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from scripts.utils import PROJECT_ROOT_PATH
+
+STARTUP = """
+import time
+start = time.perf_counter()
+import render
+imported = time.perf_counter()
+render.TEMPLATE_CACHE = {cache!r}
+for name in {templates!r}:
+    render.env().get_template(name)
+print(imported - start, time.perf_counter() - imported)
+"""
+
+
+def templates() -> list[str]:
+    macros = sorted(f"templates/{path.name}" for path in (PROJECT_ROOT_PATH / "templates").glob("*.html"))
+    return ["index.html", "index_shard.html", "game.html", "feed.xml", *macros]
+
+
+def startup(cache) -> tuple[float, float]:
+    result = subprocess.run(
+        [sys.executable, "-c", STARTUP.format(cache=cache, templates=templates())],
+        cwd=PROJECT_ROOT_PATH, check=True, capture_output=True, text=True,
+    )
+    imported, loaded = result.stdout.split()
+    return float(imported), float(loaded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'templates':<12} {'import (ms)':>11} {'load (ms)':>9} {'total (ms)':>10}")
+    with tempfile.TemporaryDirectory() as cache:
+        # Fill the cache
+        startup(cache)
+        for label, cache_dir in [("compiled", None), ("cached", cache)]:
+            runs = [startup(cache_dir) for _ in range(args.runs)]
+            imported = statistics.median(run[0] for run in runs) * 1000
+            loaded = statistics.median(run[1] for run in runs) * 1000
+            print(f"{label:<12} {imported:>11.1f} {loaded:>9.1f} {imported + loaded:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
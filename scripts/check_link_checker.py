@@ -0,0 +1,104 @@
+"""
+Check scripts/check_links.py against a local stub server
+
+The stub answers the ways the sites of the games database do: working pages with
+an ETag, missing ones, servers that are down, and servers that reject or fail on
+HEAD but answer GET. Links are checked twice with a throwaway state database, and
+the state of every link and the report are compared with what they should be.
+"""
+import asyncio
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from scripts.check_links import LinkState, check_links, new_client, report
+
+ETAG = '"v1"'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def answer(self, status, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_HEAD(self):
+        if self.path == "/ok":
+            if self.headers.get("If-None-Match") == ETAG:
+                return self.answer(304, {"ETag": ETAG})
+            return self.answer(200, {"ETag": ETAG})
+        if self.path == "/missing":
+            return self.answer(404)
+        if self.path == "/down":
+            return self.answer(503)
+        if self.path == "/no-head":
+            return self.answer(405)
+        if self.path == "/head-error":
+            return self.answer(500)
+        self.answer(404)
+
+    def do_GET(self):
+        if self.path in ("/no-head", "/head-error"):
+            return self.answer(200)
+        self.do_HEAD()
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Path of every link, with the status and failures in a row it should have after each of two checks
+EXPECTED = {
+    "/ok": [(200, 0), (304, 0)],
+    "/missing": [(404, 1), (404, 2)],
+    "/down": [(503, 1), (503, 2)],
+    "/no-head": [(200, 0), (200, 0)],
+    "/head-error": [(200, 0), (200, 0)],
+}
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    games = {base + path: [(path[1:], "games/stub.yaml")] for path in EXPECTED}
+
+    errors = []
+    with tempfile.TemporaryDirectory() as directory:
+        state = LinkState(Path(directory) / "links.sqlite")
+        try:
+            for run in range(2):
+                # No time to live, so that working links are revalidated on the second check
+                results = asyncio.run(check_links(games, state, ttl=0, attempts=2, backoff=0.01,
+                                                  client=new_client(timeout=5)))
+                state.commit()
+                rows = state.rows()
+                for path, checks in EXPECTED.items():
+                    row = rows.get(base + path)
+                    found = (row["status"], row["failures"]) if row is not None else None
+                    if found != checks[run]:
+                        errors.append(f"check {run + 1} of {path}: (status, failures) is {found}, not {checks[run]}")
+                summary = report(results, games)
+                broken = {link["url"][len(base):]: link["games"] for link in summary["broken"]}
+                expected_broken = {path: [{"name": path[1:], "file": "games/stub.yaml"}]
+                                   for path, checks in EXPECTED.items() if checks[run][0] >= 400}
+                if broken != expected_broken:
+                    errors.append(f"check {run + 1}: broken links are {broken}, not {expected_broken}")
+                if summary["not_modified"] != run:
+                    errors.append(f"check {run + 1}: {summary['not_modified']} links not modified, not {run}")
+        finally:
+            state.close()
+            server.shutdown()
+
+    for error in errors:
+        print(error)
+    if errors:
+        sys.exit(1)
+    print("The link checker records and reports the answers of the stub server as expected")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,282 @@
 """
-Check game URLs and repos for broken links
+Check game URLs, repos and images for broken links
+
+Run from the project root:
+
+    python -m scripts.check_links --report broken-links.json
+
+Links are checked concurrently through one pooled HTTP client, and only a few
+at a time per host so that no site gets flooded. Every link is requested with
+HEAD, then with GET when the server rejects or fails on HEAD, and retried with
+exponential backoff on timeouts, connection errors and overloaded servers.
+
+The state of every link is kept in .cache/links.sqlite: its last status, ETag
+and Last-Modified, when it was last checked and how many checks in a row it
+failed. Links found working are not checked again for --ttl days, then are
+revalidated with conditional requests, which servers answer with a bodiless
+304 when nothing changed. Failing links are checked first, then new ones, then
+the ones checked longest ago, so that runs cut short by --limit check what
+matters most.
 """
+import argparse
 import asyncio
+import json
+import sqlite3
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlsplit
+
 import httpx
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_exponential
+
+from _loader import safe_load
+from scripts.utils import PROJECT_ROOT_PATH
+
+STATE_PATH = PROJECT_ROOT_PATH / ".cache" / "links.sqlite"
+HEADERS = {"User-Agent": "osgameclones-link-checker (+https://osgameclones.com)"}
+# Statuses of servers that may answer later
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Results written to the state database at once
+COMMIT_EVERY = 100
+
+
+class RetryableStatus(Exception):
+    def __init__(self, status: int):
+        super().__init__(status)
+        self.status = status
+
+
+@dataclass
+class Result:
+    url: str
+    status: Optional[int] = None
+    error: Optional[str] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    cached: bool = False
+    failures: int = 0
+
+    @property
+    def ok(self) -> bool:
+        # Including 304 Not Modified, the answer to a revalidation of a working link
+        return self.status is not None and self.status < 400
+
+
+class LinkState:
+    """The state of every link checked, kept between runs in SQLite"""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS links (
+                url TEXT PRIMARY KEY,
+                status INTEGER,
+                error TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                checked REAL NOT NULL,
+                failures INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self.pending = 0
+
+    def rows(self) -> dict[str, sqlite3.Row]:
+        return {row["url"]: row for row in self.db.execute("SELECT * FROM links")}
+
+    def record(self, result: Result, previous: Optional[sqlite3.Row]):
+        """Store ``result``, counting the failures in a row since ``previous``, the state it was checked from"""
+        result.failures = 0 if result.ok else (previous["failures"] if previous else 0) + 1
+        if result.status == 304 and previous is not None:
+            # Not modified: the validators and status of the previous answer still hold
+            result.etag = result.etag or previous["etag"]
+            result.last_modified = result.last_modified or previous["last_modified"]
+        self.db.execute(
+            "INSERT OR REPLACE INTO links (url, status, error, etag, last_modified, checked, failures)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (result.url, result.status, result.error, result.etag, result.last_modified, time.time(), result.failures),
+        )
+        self.pending += 1
+        if self.pending >= COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        self.db.commit()
+        self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+
+class LinkChecker:
+    def __init__(self, client: httpx.AsyncClient, per_host=4, attempts=3, backoff=1.0):
+        self.client = client
+        self.hosts = defaultdict(lambda: asyncio.Semaphore(per_host))
+        self.attempts = attempts
+        self.backoff = backoff
+
+    async def request(self, method: str, url: str, headers: dict) -> httpx.Response:
+        retrying = AsyncRetrying(
+            stop=stop_after_attempt(self.attempts),
+            wait=wait_exponential(multiplier=self.backoff, max=30 * self.backoff),
+            retry=retry_if_exception_type((httpx.TransportError, RetryableStatus)),
+            reraise=True,
+        )
+        async for attempt in retrying:
+            with attempt:
+                # The host is left to others while waiting to retry
+                async with self.hosts[urlsplit(url).netloc]:
+                    # Streamed so that the body of a GET is never downloaded
+                    async with self.client.stream(method, url, headers=headers) as response:
+                        # A HEAD failing on the server is tried again as a GET rather than retried: plenty of
+                        # servers only break on HEAD
+                        if response.status_code in RETRY_STATUSES and (method != "HEAD" or response.status_code == 429):
+                            raise RetryableStatus(response.status_code)
+                        return response
+
+    async def check(self, url: str, previous: Optional[sqlite3.Row] = None) -> Result:
+        """Check ``url``, revalidating the answer it last gave when that worked"""
+        headers = {}
+        if previous is not None and previous["status"] is not None and previous["status"] < 400:
+            if previous["etag"]:
+                headers["If-None-Match"] = previous["etag"]
+            if previous["last_modified"]:
+                headers["If-Modified-Since"] = previous["last_modified"]
+        try:
+            response = await self.request("HEAD", url, headers)
+            if response.status_code >= 400:
+                # Plenty of servers reject or mishandle HEAD
+                response = await self.request("GET", url, headers)
+        except RetryableStatus as e:
+            return Result(url, status=e.status)
+        except httpx.HTTPError as e:
+            return Result(url, error=f"{type(e).__name__}: {e}" if str(e) else type(e).__name__)
+        return Result(url, status=response.status_code, etag=response.headers.get("ETag"),
+                      last_modified=response.headers.get("Last-Modified"))
+
+
+def priority(row: Optional[sqlite3.Row]) -> tuple:
+    """Sort key of links to check: failing ones first, then new ones, then the least recently checked"""
+    if row is None:
+        return 1, 0, 0
+    if row["failures"]:
+        return 0, -row["failures"], row["checked"]
+    return 2, 0, row["checked"]
+
+
+def new_client(concurrency=50, timeout=20.0) -> httpx.AsyncClient:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    # Links wait for a connection of the pool as long as needed
+    timeouts = httpx.Timeout(timeout, pool=None)
+    return httpx.AsyncClient(limits=limits, timeout=timeouts, headers=HEADERS, follow_redirects=True)
+
+
+async def check_links(urls, state: LinkState, ttl=7 * 24 * 3600, concurrency=50, per_host=4, timeout=20.0,
+                      attempts=3, backoff=1.0, limit=None, client: Optional[httpx.AsyncClient] = None) -> list[Result]:
+    """
+    Check ``urls``, except those found working less than ``ttl`` seconds ago in ``state``, and record the results
+
+    At most ``limit`` links are checked, by order of ``priority``, through ``client`` if given, which is closed
+    afterwards.
+    """
+    rows = state.rows()
+    now = time.time()
+    results = []
+    pending = []
+    for url in urls:
+        row = rows.get(url)
+        if row is not None and row["status"] is not None and row["status"] < 400 and now - row["checked"] < ttl:
+            results.append(Result(url, status=row["status"], etag=row["etag"], last_modified=row["last_modified"],
+                                  cached=True))
+        else:
+            pending.append(url)
+    pending.sort(key=lambda url: priority(rows.get(url)))
+
+    async with client or new_client(concurrency, timeout) as client:
+        checker = LinkChecker(client, per_host, attempts, backoff)
+
+        async def check(url):
+            result = await checker.check(url, rows.get(url))
+            # Recorded as soon as known, so that an interrupted run keeps it
+            state.record(result, rows.get(url))
+            return result
+
+        results += await asyncio.gather(*(check(url) for url in pending[:limit]))
+    return results
+
+
+def links() -> dict[str, list[tuple[str, str]]]:
+    """The names and files of the games of every link to check"""
+    games = defaultdict(list)
+    for path in sorted((PROJECT_ROOT_PATH / "games").glob("*.yaml")):
+        file = str(path.relative_to(PROJECT_ROOT_PATH))
+        with open(path, encoding="utf-8") as f:
+            entries = safe_load(f)
+        for game in entries:
+            for url in [game.get("repo"), game.get("url"), *game.get("images", [])]:
+                if url:
+                    games[url].append((game["name"], file))
+            # TODO: check videos
+    return games
+
+
+def report(results: list[Result], games: dict) -> dict:
+    broken = [result for result in results if not result.ok]
+    return {
+        "links": len(results),
+        "checked": sum(not result.cached for result in results),
+        "not_modified": sum(result.status == 304 for result in results),
+        "broken": [
+            {
+                "url": result.url,
+                "status": result.status,
+                "error": result.error,
+                "failures": result.failures,
+                "games": [{"name": name, "file": file} for name, file in games[result.url]],
+            }
+            for result in sorted(broken, key=lambda result: result.url)
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--ttl", type=float, default=7, help="days before a working link is checked again")
+    parser.add_argument("--concurrency", type=int, default=50, help="links checked at once")
+    parser.add_argument("--per-host", type=int, default=4, help="links checked at once on the same host")
+    parser.add_argument("--timeout", type=float, default=20, help="seconds to wait for a server")
+    parser.add_argument("--attempts", type=int, default=3, help="tries of a link failing for a server error")
+    parser.add_argument("--limit", type=int, help="links checked at most, failing and stale ones first")
+    parser.add_argument("--state", type=Path, default=STATE_PATH, help="SQLite database of the state of links")
+    parser.add_argument("--report", type=Path, help="write the broken links and their games as JSON")
+    args = parser.parse_args()
+
+    games = links()
+    state = LinkState(args.state)
+    print(f"Checking {len(games)} links...")
+    try:
+        results = asyncio.run(check_links(
+            games, state, args.ttl * 24 * 3600, args.concurrency, args.per_host, args.timeout, args.attempts,
+            limit=args.limit,
+        ))
+    finally:
+        state.close()
 
-from scripts.utils import games
-
-
-async def check_link(q):
-    while True:
-        game, url = await q.get()
-        resp = httpx.get(url)
-        if not resp.is_success:
-            print(f"{url} returned {resp.status_code} ({game['name']})")
-        q.task_done()
-
-
-async def main():
-    q = asyncio.Queue()
-    # start workers
-    worker_tasks = []
-    for i in range(10):
-        task = asyncio.create_task(check_link(q))
-        worker_tasks.append(task)
-    # add urls to queue
-    for game in games():
-        print(f"Checking {game['name']}...")
-        if "repo" in game:
-            await q.put((game, game["repo"]))
-        if "url" in game:
-            await q.put((game, game["url"]))
-        for img in game.get("images", []):
-            await q.put((game, img))
-        # TODO: check videos
-    # wait for tasks to complete
-    print("Waiting for workers...")
-    await q.join()
-    # stop workers
-    for task in worker_tasks:
-        task.cancel()
-    await asyncio.gather(*worker_tasks, return_exceptions=True)
+    summary = report(results, games)
+    for link in summary["broken"]:
+        reason = f"returned {link['status']}" if link["error"] is None else f"failed ({link['error']})"
+        names = ", ".join(f"{game['name']} in {game['file']}" for game in link["games"])
+        print(f"{link['url']} {reason}, {link['failures']} times in a row ({names})")
+    print(f"{summary['links']} links, {summary['checked']} checked, {summary['not_modified']} not modified, "
+          f"{len(summary['broken'])} broken")
+    if args.report:
+        args.report.write_text(json.dumps(summary, indent=2))
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
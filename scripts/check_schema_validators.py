@@ -0,0 +1,121 @@
+"""
+Check that the compiled schema validators accept and reject the same documents as pykwalify
+
+Both validators are run on every file of the games database, then on entries of it
+broken in all the ways the schemas check for. They must agree on every document,
+down to the error messages.
+"""
+import logging
+import sys
+from datetime import date
+
+from pykwalify.core import Core
+
+import _validator
+from scripts.utils import PROJECT_ROOT_PATH
+from _loader import safe_load
+
+DELETE = object()
+
+GAME_MUTATIONS = [
+    *[(key, DELETE) for key in ("name", "originals", "type", "status", "langs", "licenses", "updated")],
+    ("bogus", 1),
+    ("name", ["a", "b"]),
+    ("name", None),
+    ("originals", None),
+    ("originals", "Doom"),
+    ("originals", ["Doom", "Doom"]),
+    ("type", "bogus"),
+    ("type", 5),
+    ("status", None),
+    ("development", "dormant"),
+    ("langs", "C++"),
+    ("langs", ["C", "C"]),
+    ("langs", [1, None]),
+    ("licenses", ["Nope"]),
+    ("platforms", ["Linux", "Linux"]),
+    ("platforms", ["Nope"]),
+    ("multiplayer", ["Online", "Bogus"]),
+    ("content", "nothing"),
+    ("ai", "yes"),
+    ("images", ["http://example.com/insecure.png"]),
+    ("images", [5]),
+    ("images", {"url": "https://example.com"}),
+    ("updated", "2020-13-45"),
+    ("updated", "yesterday"),
+    ("updated", 5),
+    ("added", date(2020, 1, 1)),
+    ("video", None),
+    ("video", {"youtube": "short"}),
+    ("video", {"youtube": 12345678901}),
+    ("video", {"vimeo": "123"}),
+    ("video", {"bogus": 1}),
+    ("video", "DowgWKtGAD8"),
+]
+
+ORIGINAL_MUTATIONS = [
+    ("name", DELETE),
+    ("external", DELETE),
+    ("bogus", 1),
+    ("names", "Other name"),
+    ("names", [["a", "b"]]),
+    ("external", None),
+    ("external", {}),
+    ("external", {"website": 5, "wiki": "x"}),
+    ("platforms", ["Nope", "Linux", "Linux"]),
+    ("meta", None),
+    ("meta", {"genres": ["Nope"], "themes": "Fantasy"}),
+    ("meta", {"subgenres": ["4X", "4X"], "mood": []}),
+]
+
+
+def pykwalify_errors(data, schema_file) -> list[str]:
+    core = Core(source_data=data, schema_files=[str(schema_file)])
+    core.validate(raise_exception=False)
+    return sorted(error if isinstance(error, str) else repr(error) for error in core.errors)
+
+
+def compiled_errors(data, schema_file) -> list[str]:
+    return sorted(repr(error) for error in _validator.load_validator(str(schema_file))(data))
+
+
+def mutated(entries: list[dict], mutations):
+    for key, value in mutations:
+        entry = dict(entries[0])
+        if value is DELETE:
+            entry.pop(key, None)
+        else:
+            entry[key] = value
+        yield f"{key}={value!r}" if value is not DELETE else f"no {key}", [entry] + entries[1:]
+    yield "entry is a string", ["not a game"] + entries[1:]
+    yield "entry is None", [None] + entries[1:]
+
+
+def main():
+    # pykwalify logs every invalid document, and most of these are invalid on purpose
+    logging.getLogger("pykwalify").setLevel(logging.CRITICAL)
+    failed = False
+    checked = 0
+    for kind, schema, mutations in (
+        ("games", "games.yaml", GAME_MUTATIONS),
+        ("originals", "originals.yaml", ORIGINAL_MUTATIONS),
+    ):
+        schema_file = PROJECT_ROOT_PATH / "schema" / schema
+        for path in sorted((PROJECT_ROOT_PATH / kind).glob("*.yaml")):
+            entries = safe_load(open(path, encoding="utf-8"))
+            for description, data in [("as is", entries), *mutated(entries, mutations)]:
+                expected = pykwalify_errors(data, schema_file)
+                actual = compiled_errors(data, schema_file)
+                checked += 1
+                if expected != actual:
+                    failed = True
+                    print(f"{kind}/{path.name} ({description}):")
+                    print(f"  pykwalify: {expected}")
+                    print(f"  compiled:  {actual}")
+    if failed:
+        sys.exit(1)
+    print(f"Compiled validators agree with pykwalify on {checked} documents")
+
+
+if __name__ == "__main__":
+    main()
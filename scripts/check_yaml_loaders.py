@@ -0,0 +1,52 @@
+"""
+Check that libyaml's C loader and the pure-Python loader agree on the games database
+
+The build uses whichever loader _loader picks, so both must produce exactly the same
+data for every file, including the dates of added/updated.
+"""
+import sys
+
+import yaml
+
+from scripts.utils import PROJECT_ROOT_PATH
+
+DATE_KEYS = ("added", "updated")
+
+
+def check_file(path) -> list[str]:
+    content = path.read_text(encoding="utf-8")
+    python_data = yaml.load(content, Loader=yaml.SafeLoader)
+    c_data = yaml.load(content, Loader=yaml.CSafeLoader)
+    if len(python_data) != len(c_data):
+        return [f"loaders disagree on the number of entries ({len(python_data)} != {len(c_data)})"]
+    errors = []
+    for p, c in zip(python_data, c_data):
+        if p != c:
+            errors.append(f"loaders disagree on {p.get('name')}")
+        # Dates may be written quoted (str) or not (date); both loaders must coerce them alike
+        for key in DATE_KEYS:
+            if type(p.get(key)) is not type(c.get(key)):
+                errors.append(
+                    f"{p.get('name')}: {key} is {type(p.get(key)).__name__} with the Python loader "
+                    f"but {type(c.get(key)).__name__} with the C loader"
+                )
+    return errors
+
+
+def main():
+    if not yaml.__with_libyaml__:
+        print("PyYAML was built without libyaml, nothing to compare")
+        return
+    failed = False
+    for kind in ("games", "originals"):
+        for path in sorted((PROJECT_ROOT_PATH / kind).glob("*.yaml")):
+            for error in check_file(path):
+                print(f"{kind}/{path.name}: {error}")
+                failed = True
+    if failed:
+        sys.exit(1)
+    print("C and Python loaders produce identical data")
+
+
+if __name__ == "__main__":
+    main()
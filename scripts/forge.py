@@ -0,0 +1,395 @@
+"""
+Asynchronous client of the forges hosting games, shared by the maintenance scripts
+
+Covers GitHub, GitLab, Codeberg (and other Gitea forges through their API
+URL) and SourceForge activity feeds:
+
+    async with ForgeClient() as client:
+        repos = await map_bounded(client.repo, repo_urls, workers=8)
+
+Requests to every forge go through a token bucket, which starts at a modest
+rate and then follows the rate limit the forge announces in its X-RateLimit-*
+or RateLimit-* headers, so that scripts slow down before being refused. When
+refused anyway, requests wait for the reset of the limit and are retried.
+
+Responses are kept in .cache/forge.sqlite and revalidated with their ETag or
+Last-Modified, which forges answer with a bodiless 304 that GitHub does not
+even count against the rate limit. Responses younger than the ``max_age`` of
+the client are used without asking.
+
+Tokens are read from GH_TOKEN (or GITHUB_TOKEN), GL_TOKEN and CODEBERG_TOKEN;
+forges without one are queried anonymously, with lower rate limits.
+"""
+import asyncio
+import base64
+import json
+import os
+import re
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Awaitable, Callable, Iterable, Optional
+from urllib.parse import quote
+
+import httpx
+
+from scripts.utils import PROJECT_ROOT_PATH
+
+CACHE_PATH = PROJECT_ROOT_PATH / ".cache" / "forge.sqlite"
+# Responses written to the cache at once
+COMMIT_EVERY = 100
+
+API_URLS = {
+    "github": "https://api.github.com",
+    "gitlab": "https://gitlab.com/api/v4",
+    "codeberg": "https://codeberg.org/api/v1",
+    "sourceforge": "https://sourceforge.net",
+}
+REPO_REGEXES = {
+    "github": re.compile(r"https://github.com/([^/]+/[^/]+)"),
+    "gitlab": re.compile(r"https://gitlab.com/([^/]+/[^/]+)"),
+    "codeberg": re.compile(r"https://codeberg.org/([^/]+/[^/]+)"),
+    "sourceforge": re.compile(r"https://sourceforge.net/projects/([^/]+)"),
+}
+TOKEN_VARIABLES = {
+    "github": ["GH_TOKEN", "GITHUB_TOKEN"],
+    "gitlab": ["GL_TOKEN"],
+    "codeberg": ["CODEBERG_TOKEN"],
+}
+USER_AGENT = "osgameclones-scripts (+https://osgameclones.com)"
+# Requests per second before a forge tells its limit, and the burst allowed
+INITIAL_RATE = 5.0
+BURST = 10
+# Tries of a request refused for exceeding the rate limit or failing on the forge's side
+ATTEMPTS = 4
+
+
+class ForgeError(Exception):
+    def __init__(self, url: str, status: Optional[int], message: str = ""):
+        super().__init__(f"{url}: {status or ''} {message}".strip())
+        self.url = url
+        self.status = status
+
+
+@dataclass
+class Repo:
+    forge: str
+    name: str
+    url: str
+    stars: Optional[int] = None
+    topics: list[str] = field(default_factory=list)
+
+
+def parse_repo_url(repo_url: str) -> Optional[tuple[str, str]]:
+    """The forge and the name of the repo at ``repo_url``, or None if not on a known forge"""
+    for forge, regex in REPO_REGEXES.items():
+        if match := regex.match(repo_url):
+            return forge, match[1]
+    return None
+
+
+def tokens_from_env() -> dict[str, str]:
+    tokens = {}
+    for forge, variables in TOKEN_VARIABLES.items():
+        for variable in variables:
+            if os.environ.get(variable):
+                tokens[forge] = os.environ[variable]
+                break
+    return tokens
+
+
+def parse_date(value: str) -> datetime:
+    """A naive UTC datetime from an ISO 8601 date of a forge API"""
+    date = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date
+
+
+async def map_bounded(fn: Callable[..., Awaitable], items: Iterable, workers=8) -> list:
+    """``fn`` awaited on every item of ``items``, at most ``workers`` at a time, with results in order"""
+    semaphore = asyncio.Semaphore(workers)
+
+    async def run(item):
+        async with semaphore:
+            return await fn(item)
+
+    return await asyncio.gather(*(run(item) for item in items))
+
+
+def rate_limit_header(headers: httpx.Headers, name: str) -> Optional[float]:
+    # GitHub and Gitea use X-RateLimit-*, GitLab RateLimit-*
+    value = headers.get(f"x-ratelimit-{name}", headers.get(f"ratelimit-{name}"))
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """A token bucket, refilled at the rate that spends what a forge allows until its limit resets"""
+
+    def __init__(self, rate=INITIAL_RATE, burst=BURST):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self.lock:
+            self.refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.refill()
+            self.tokens -= 1
+
+    def update(self, headers: httpx.Headers):
+        """Follow the remaining requests and reset time a forge announces"""
+        remaining = rate_limit_header(headers, "remaining")
+        reset = rate_limit_header(headers, "reset")
+        if remaining is None or reset is None:
+            return
+        self.refill()
+        # Reset times are epoch seconds, but some Gitea versions send seconds left
+        window = max(reset - time.time() if reset > 1e9 else reset, 1.0)
+        self.tokens = min(self.tokens, remaining)
+        # With nothing left, the next token comes when the limit resets
+        self.rate = max(remaining, 1) / window
+
+    def wait_for_reset(self, headers: httpx.Headers) -> float:
+        """Seconds to wait before retrying a request refused for exceeding the rate limit"""
+        if (retry_after := headers.get("retry-after")) and retry_after.isdigit():
+            return float(retry_after)
+        if (reset := rate_limit_header(headers, "reset")) is not None:
+            return max((reset - time.time()) if reset > 1e9 else reset, 1.0)
+        return 60.0
+
+
+class ResponseCache:
+    """Bodies and validators of the responses of forges, kept between runs in SQLite"""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                link TEXT,
+                body BLOB NOT NULL,
+                fetched REAL NOT NULL
+            )
+        """)
+        self.pending = 0
+
+    def get(self, key: str) -> Optional[tuple]:
+        return self.db.execute(
+            "SELECT etag, last_modified, link, body, fetched FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+
+    def put(self, key: str, response: httpx.Response):
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+            (key, response.headers.get("etag"), response.headers.get("last-modified"), response.headers.get("link"),
+             response.content, time.time()),
+        )
+        self.pending += 1
+        if self.pending >= COMMIT_EVERY:
+            self.db.commit()
+            self.pending = 0
+
+    def touch(self, key: str):
+        self.db.execute("UPDATE responses SET fetched = ? WHERE key = ?", (time.time(), key))
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+@dataclass
+class Response:
+    body: bytes
+    link: Optional[str] = None
+    cached: bool = False
+
+    def json(self):
+        return json.loads(self.body)
+
+    def next_url(self) -> Optional[str]:
+        """The URL of the next page of a paginated response"""
+        if self.link and (match := re.search(r'<([^>]+)>;\s*rel="next"', self.link)):
+            return match[1]
+        return None
+
+
+class ForgeClient:
+    def __init__(self, tokens: Optional[dict] = None, cache_path: Optional[Path] = CACHE_PATH, max_age=0.0,
+                 api_urls: Optional[dict] = None, concurrency=16, timeout=30.0):
+        self.tokens = tokens_from_env() if tokens is None else tokens
+        self.cache = ResponseCache(cache_path) if cache_path else None
+        self.max_age = max_age
+        # Other URLs point the client at e.g. a local fake of a forge
+        self.api_urls = {**API_URLS, **(api_urls or {})}
+        self.limiters = {forge: RateLimiter() for forge in self.api_urls}
+        self.client = httpx.AsyncClient(
+            headers={"User-Agent": USER_AGENT},
+            limits=httpx.Limits(max_connections=concurrency),
+            timeout=httpx.Timeout(timeout, pool=None),
+            follow_redirects=True,
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await self.client.aclose()
+        if self.cache:
+            self.cache.close()
+
+    def auth_headers(self, forge: str) -> dict:
+        if not (token := self.tokens.get(forge)):
+            return {}
+        if forge == "github":
+            return {"Authorization": f"Bearer {token}"}
+        if forge == "gitlab":
+            return {"PRIVATE-TOKEN": token}
+        return {"Authorization": f"token {token}"}
+
+    async def request(self, forge: str, method: str, url: str, headers: Optional[dict] = None,
+                      json_body=None) -> httpx.Response:
+        """Send a request to ``forge`` within its rate limit, retrying when refused for exceeding it"""
+        limiter = self.limiters[forge]
+        headers = {**self.auth_headers(forge), **(headers or {})}
+        for attempt in range(ATTEMPTS):
+            await limiter.acquire()
+            try:
+                response = await self.client.request(method, url, headers=headers, json=json_body)
+            except httpx.TransportError as e:
+                if attempt == ATTEMPTS - 1:
+                    raise ForgeError(url, None, f"{type(e).__name__}: {e}") from e
+                await asyncio.sleep(2 ** attempt)
+                continue
+            limiter.update(response.headers)
+            # GitHub refuses with a 403 both for its primary limit and its secondary, concurrency one
+            limited = response.status_code == 429 or response.status_code == 403 and (
+                rate_limit_header(response.headers, "remaining") == 0 or "retry-after" in response.headers)
+            if limited and attempt < ATTEMPTS - 1:
+                await asyncio.sleep(limiter.wait_for_reset(response.headers))
+                continue
+            if response.status_code >= 500 and attempt < ATTEMPTS - 1:
+                await asyncio.sleep(2 ** attempt)
+                continue
+            return response
+        return response
+
+    async def get(self, forge: str, url: str, headers: Optional[dict] = None) -> Response:
+        """GET ``url`` from ``forge``, through the response cache"""
+        key = f"{(headers or {}).get('Accept', '')} {url}"
+        cached = self.cache.get(key) if self.cache else None
+        request_headers = dict(headers or {})
+        if cached:
+            etag, last_modified, link, body, fetched = cached
+            if time.time() - fetched < self.max_age:
+                return Response(body, link, cached=True)
+            if etag:
+                request_headers["If-None-Match"] = etag
+            if last_modified:
+                request_headers["If-Modified-Since"] = last_modified
+        response = await self.request(forge, "GET", url, request_headers)
+        if response.status_code == 304 and cached:
+            self.cache.touch(key)
+            return Response(body, link, cached=True)
+        if not response.is_success:
+            raise ForgeError(url, response.status_code, response.text[:200])
+        if self.cache:
+            self.cache.put(key, response)
+        return Response(response.content, response.headers.get("link"))
+
+    async def get_json(self, forge: str, path: str, headers: Optional[dict] = None):
+        return (await self.get(forge, self.api_urls[forge] + path, headers)).json()
+
+    async def get_pages(self, forge: str, path: str) -> list:
+        """Every item of a paginated list, following the next links of GitHub, GitLab and Gitea"""
+        items = []
+        url = self.api_urls[forge] + path
+        while url:
+            response = await self.get(forge, url)
+            items += response.json()
+            url = response.next_url()
+        return items
+
+    async def github_graphql(self, query: str, variables: dict) -> dict:
+        """The decoded response of a query to GitHub's GraphQL API, which cannot be cached"""
+        url = self.api_urls["github"] + "/graphql"
+        response = await self.request("github", "POST", url, json_body={"query": query, "variables": variables})
+        if not response.is_success:
+            raise ForgeError(url, response.status_code, response.text[:200])
+        return response.json()
+
+    async def github_file(self, repo: str, path: str, ref: str) -> str:
+        """The text of the file at ``path`` in GitHub repo ``repo`` (owner/name) at commit ``ref``"""
+        contents = await self.get_json("github", f"/repos/{repo}/contents/{quote(path)}?ref={ref}")
+        return base64.b64decode(contents["content"]).decode()
+
+    async def repo(self, repo_url: str) -> Optional[Repo]:
+        """The stars and topics of a repo on GitHub, GitLab or Codeberg, or None on another forge"""
+        parsed = parse_repo_url(repo_url)
+        if parsed is None or parsed[0] == "sourceforge":
+            return None
+        forge, name = parsed
+        if forge == "github":
+            data = await self.get_json(forge, f"/repos/{name}")
+            return Repo(forge, name, repo_url, data.get("stargazers_count"), data.get("topics", []))
+        if forge == "gitlab":
+            data = await self.get_json(forge, f"/projects/{quote(name, safe='')}")
+            return Repo(forge, name, repo_url, data.get("star_count"), data.get("topics", []))
+        data = await self.get_json(forge, f"/repos/{name}")
+        topics = (await self.get_json(forge, f"/repos/{name}/topics")).get("topics", [])
+        return Repo(forge, name, repo_url, data.get("stars_count"), topics)
+
+    async def latest_commit_date(self, repo_url: str) -> Optional[datetime]:
+        """The date of the latest commit on any branch of a repo, or None if unknown"""
+        parsed = parse_repo_url(repo_url)
+        if parsed is None:
+            return None
+        forge, name = parsed
+        if forge == "github":
+            # Branches come without dates, which are those of their head commits. pushed_at is no substitute: it
+            # also moves on pushes of tags and deletions of branches
+            branches = await self.get_pages(forge, f"/repos/{name}/branches?per_page=100")
+            commits = await asyncio.gather(*(
+                self.get_json(forge, f"/repos/{name}/commits/{branch['commit']['sha']}") for branch in branches
+            ))
+            dates = [parse_date(commit["commit"]["committer"]["date"]) for commit in commits]
+            return max(dates) if dates else None
+        if forge == "gitlab":
+            branches = await self.get_pages(forge, f"/projects/{quote(name, safe='')}/repository/branches?per_page=100")
+            dates = [parse_date(branch["commit"]["created_at"]) for branch in branches]
+            return max(dates) if dates else None
+        if forge == "codeberg":
+            branches = await self.get_pages(forge, f"/repos/{name}/branches?limit=50")
+            dates = [parse_date(branch["commit"]["timestamp"]) for branch in branches]
+            return max(dates) if dates else None
+        return await self.sourceforge_commit_date(name)
+
+    async def sourceforge_commit_date(self, project: str) -> Optional[datetime]:
+        import feedparser
+
+        response = await self.get("sourceforge", f"{self.api_urls['sourceforge']}/p/{project}/activity/feed.rss")
+        for entry in feedparser.parse(response.body).entries:
+            # Only look for commits
+            if " committed " in entry["title"]:
+                return datetime(*entry["published_parsed"][:6])
+        return None
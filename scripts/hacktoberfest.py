@@ -1,11 +1,10 @@
 """
 This script finds repos participating in hacktoberfest:
-- Hosted on GitHub or gitlab
+- Hosted on GitHub, GitLab or Codeberg
 - Includes the "hacktoberfest" topic
 
 To run, install from pip:
-- pygithub
-- python-gitlab
+- httpx
 
 Add environment variables:
 - GH_TOKEN (see https://docs.github.com/en/authentication/keeping-your-account-and-data-secure/creating-a-personal-access-token#creating-a-token)
@@ -13,52 +12,37 @@ Add environment variables:
 - GL_TOKEN (see https://docs.gitlab.com/ee/user/profile/personal_access_tokens.html#create-a-personal-access-token)
   - with read_api scope
 """
-import os
-import re
-
-from github import Github, GithubException
-from gitlab import Gitlab, GitlabHttpError, GitlabGetError
+import argparse
+import asyncio
 
+from scripts.forge import ForgeClient, ForgeError, map_bounded
 from scripts.utils import games
 
-GH_REGEX = re.compile(r"https://github.com/([^/]+)/([^/]+)")
-GL_REGEX = re.compile(r"https://gitlab.com/([^/]+/[^/]+)")
-
 
-def main():
-    gh = Github(os.environ["GH_TOKEN"])
-    gl = Gitlab("https://gitlab.com", private_token=os.environ["GL_TOKEN"])
-    hacktober_games = {}
-    for game in games():
-        repo_url = game.get("repo", "")
-        if not repo_url:
-            continue
-        match = re.match(GH_REGEX, repo_url)
-        if match:
-            owner, repo = match.groups()
+async def find_hacktober_games(games_with_repos, workers=8, client=None) -> dict:
+    async with client or ForgeClient() as client:
+        async def get_repo(game):
             try:
-                gh_repo = gh.get_repo(f"{owner}/{repo}")
-            except GithubException as e:
-                print(f"Error getting GitHub repo info for {owner}/{repo}: {e}")
-                continue
-            topics = gh_repo.get_topics()
-            if "hacktoberfest" in topics:
-                game["platform"] = "github"
-                game["stars"] = gh_repo.stargazers_count
+                return await client.repo(game["repo"])
+            except ForgeError as e:
+                print(f"Error getting repo info for {game['repo']}: {e}")
+                return None
+
+        hacktober_games = {}
+        for game, repo in zip(games_with_repos, await map_bounded(get_repo, games_with_repos, workers)):
+            if repo is not None and "hacktoberfest" in repo.topics:
+                game["platform"] = repo.forge
+                game["stars"] = repo.stars
                 hacktober_games[game["name"]] = game
-        else:
-            match = re.match(GL_REGEX, repo_url)
-            if match:
-                project_namespace = match.groups()[0]
-                try:
-                    project = gl.projects.get(project_namespace)
-                except (GitlabHttpError, GitlabGetError) as e:
-                    print(f"Error getting Gitlab repo info for {project_namespace}: {e}")
-                    continue
-                if "hacktoberfest" in project.topics:
-                    game["platform"] = "gitlab"
-                    game["stars"] = project.star_count
-                    hacktober_games[game["name"]] = game
+        return hacktober_games
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the repos of games participating in hacktoberfest")
+    parser.add_argument("--workers", type=int, default=8, help="repos queried at once")
+    args = parser.parse_args()
+
+    hacktober_games = asyncio.run(find_hacktober_games([game for game in games() if game.get("repo")], args.workers))
     for name, game in hacktober_games.items():
         stars_badge = f"![stars](https://img.shields.io/badge/{game['platform']}%20stars-{game['stars']}-blue)"
         langs = ", ".join(f"`{lang}`" for lang in game.get('langs', []))
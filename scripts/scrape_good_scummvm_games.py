@@ -5,6 +5,10 @@ Uses libraries:
 - beautifulsoup4
 - httpx
 - tenacity
+
+Run from the project root:
+
+    python -m scripts.scrape_good_scummvm_games
 """
 import re
 from pathlib import Path
@@ -14,7 +18,9 @@ import httpx
 import yaml
 from bs4 import BeautifulSoup
 from tenacity import stop_after_attempt, retry, wait_exponential
-from utils import originals
+
+from _loader import safe_load
+from scripts.utils import originals
 
 SCUMMVM_LIST = "https://www.scummvm.org/compatibility/"
 SCUMMVM_BASE_URL = "https://www.scummvm.org"
@@ -46,7 +52,8 @@ def main():
             osgc_originals.add(name)
 
     # Get platforms
-    platforms = yaml.safe_load(open(Path("schema") / "originals.yaml", encoding="utf-8"))["schema;platforms"]["enum"]
+    with open(Path("schema") / "originals.yaml", encoding="utf-8") as f:
+        platforms = safe_load(f)["schema;platforms"]["enum"]
 
     # Get list of games
     resp = httpx.get(SCUMMVM_LIST)
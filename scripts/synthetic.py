@@ -0,0 +1,67 @@
+"""
+Generate a synthetic, schema-valid games database that is a multiple of the real one
+
+Every copy after the first renames all originals and clones (and the references
+between them) with a " (copy N)" suffix and makes repos/URLs unique, so the result
+passes the same checks as the real database.
+"""
+import os
+import shutil
+from pathlib import Path
+
+import _ext
+from _loader import safe_dump, safe_load
+from scripts.utils import PROJECT_ROOT_PATH
+
+
+def suffixed(name, copy):
+    return name if copy == 0 else f"{name} (copy {copy})"
+
+
+def copy_original(original: dict, copy: int) -> dict:
+    result = dict(original, name=suffixed(original["name"], copy))
+    if "names" in original:
+        result["names"] = [suffixed(name, copy) for name in original["names"]]
+    return result
+
+
+def copy_game(game: dict, copy: int) -> dict:
+    result = dict(
+        game,
+        name=suffixed(game["name"], copy),
+        originals=[suffixed(name, copy) for name in game["originals"]],
+    )
+    for key in ("repo", "url"):
+        if key in game and copy:
+            result[key] = f"{game[key]}#copy{copy}"
+    return result
+
+
+def write_entries(path: Path, entries: list[dict]):
+    # Renaming may change the order, so sort the same way the real files are
+    entries = sorted(entries, key=_ext.collation_key)
+    with open(path, "w", encoding="utf-8") as f:
+        safe_dump(entries, f, allow_unicode=True, sort_keys=False)
+
+
+def generate(dest: Path, factor: int, source: Path = PROJECT_ROOT_PATH) -> dict:
+    """
+    Write originals/ and games/ directories holding ``factor`` copies of the database under ``dest``
+    and return the number of entries written to each
+    """
+    if dest.exists():
+        shutil.rmtree(dest)
+    counts = {}
+    for kind, copy_entry in (("originals", copy_original), ("games", copy_game)):
+        counts[kind] = 0
+        os.makedirs(dest / kind)
+        for p in sorted((source / kind).iterdir()):
+            if not (p.is_file() and p.suffix == ".yaml"):
+                continue
+            with open(p, encoding="utf-8") as f:
+                entries = safe_load(f)
+            for copy in range(factor):
+                name = p.name if copy == 0 else f"{p.stem}_copy{copy}.yaml"
+                write_entries(dest / kind / name, [copy_entry(entry, copy) for entry in entries])
+                counts[kind] += len(entries)
+    return counts
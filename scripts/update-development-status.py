@@ -2,8 +2,19 @@
 This script updates games development status
 
 To run, install from pip:
-- pygithub
-- python-gitlab
+- httpx
+- feedparser
+
+Repos on GitHub, GitLab, Codeberg and SourceForge are queried concurrently
+through scripts/forge.py, --workers at a time. With --graphql the dates of
+GitHub repos are instead fetched up front through GitHub's GraphQL API,
+--batch-size repos per query.
+
+The new statuses are printed, and with --write saved to the games files along
+with today's date as the updated date of the games whose status changed. Only
+the changed values are rewritten, at their offsets in the text of the files, so
+that their layout, quoting and comments are left as they are. The files are
+parsed in parallel, in a pool of processes.
 
 Add environment variables:
 - GH_TOKEN
@@ -14,50 +25,60 @@ Add environment variables:
   - (see https://docs.gitlab.com/ee/user/profile/personal_access_tokens.html#create-a-personal-access-token)
   - With read_api scope
 """
-import os
+import argparse
+import asyncio
 import re
-from typing import Optional
-
-import yaml
-
-import feedparser
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Iterable, Optional
 
 from pathlib import Path
-from datetime import datetime, timedelta
-from github import Github, GithubException
-from gitlab import Gitlab
-from time import mktime
+from datetime import date, datetime, timedelta
 
-GL_HOST = 'https://gitlab.com'
-SF_HOST = 'https://sourceforge.net'
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from _loader import SafeLoader
+from scripts.forge import ForgeClient, ForgeError, map_bounded, parse_repo_url
 
 GH_REGEX = re.compile(r'https://github.com/([^/]+)/([^/]+)')
-GL_REGEX = re.compile(GL_HOST + r'/([^/]+/[^/]+)')
-SF_REGEX = re.compile(SF_HOST + r"/projects/([^/]+)")
 
-GH_DT_FMT = "%a, %d %b %Y %H:%M:%S %Z"
+GH_GRAPHQL_DT_FMT = '%Y-%m-%dT%H:%M:%SZ'
 
+# Takes a GraphQL query and its variables, and returns the decoded JSON response
+Transport = Callable[[str, dict], Awaitable[dict]]
 
-def main():
-    gh = Github(os.environ["GH_TOKEN"])
-    gl = Gitlab(GL_HOST, private_token=os.environ["GL_TOKEN"])
+# Keys whose values may be rewritten, and the key a missing one is inserted before
+EDITED_KEYS = {'development': 'status', 'updated': None}
 
-    for filename in Path('games').iterdir():
-        if not filename.is_file() or filename.suffix != '.yaml':
-            continue
 
-        games = yaml.safe_load(open(filename, encoding='utf-8'))
-        for game in games:
+def main():
+    parser = argparse.ArgumentParser(description='Update the development status of games')
+    parser.add_argument('--workers', type=int, default=8, help='repos queried at once')
+    parser.add_argument('--graphql', action='store_true',
+                        help='fetch the dates of GitHub repos in batches through the GraphQL API')
+    parser.add_argument('--batch-size', type=int, default=50, help='GitHub repos per GraphQL query, at most 100')
+    parser.add_argument('--write', action='store_true', help='save the new statuses to the games files')
+    args = parser.parse_args()
+
+    paths = sorted(path for path in Path('games').iterdir() if path.is_file() and path.suffix == '.yaml')
+    with ProcessPoolExecutor() as executor:
+        files = list(executor.map(GamesFile.read, paths))
+
+    repos = {game['repo'] for games_file in files for game in games_file.games
+             if 'added' in game and needs_update(game)}
+    dates = asyncio.run(get_latest_commit_dates(repos, args.workers, args.graphql, args.batch_size))
+
+    today = date.today()
+    for games_file in files:
+        for i, game in enumerate(games_file.games):
             if 'added' not in game:
                 print(f"{game['name']} has no added field")
                 continue
 
-            repo_url = game.get('repo', '')
-
-            if len(repo_url) == 0 or game.get('development', '') == 'complete':
+            if not needs_update(game):
                 continue
 
-            if (latest_commit_date := get_latest_commit_date(repo_url, gh, gl)) is None:
+            if (latest_commit_date := dates.get(game['repo'])) is None:
                 continue
 
             diff = datetime.now() - latest_commit_date
@@ -73,81 +94,189 @@ def main():
                 game['development'] = 'halted'
             if status_original != game["development"]:
                 print(f"{game['name']} status should be {game['development']} ({status_original=})")
-
-        # yaml.dump(games, open(filename, 'w', encoding='utf-8'), sort_keys=False)
-        # print(filename, 'has been updated')
+                games_file.set(i, 'development', game['development'])
+                games_file.set(i, 'updated', today.isoformat())
+
+    if args.write:
+        # Each file by a thread of its own
+        with ThreadPoolExecutor() as executor:
+            for path, edits in zip(paths, executor.map(GamesFile.write, files)):
+                if edits:
+                    print(path, 'has been updated,', edits, 'values changed')
+
+
+async def get_latest_commit_dates(repo_urls, workers=8, graphql=False, batch_size=50, client=None) -> dict:
+    """The date of the latest commit of every repo, by URL, for the repos it could be found for"""
+    async with client or ForgeClient() as client:
+        dates = {}
+        if graphql:
+            github_urls = [repo_url for repo_url in repo_urls if is_github_repo(repo_url)]
+            dates = await GithubGraphQL(client.github_graphql, batch_size).latest_commit_dates(github_urls)
+            repo_urls = [repo_url for repo_url in repo_urls if not is_github_repo(repo_url)]
+
+        async def get(repo_url):
+            return repo_url, await get_latest_commit_date(client, repo_url)
+
+        for repo_url, commit_date in await map_bounded(get, sorted(repo_urls), workers):
+            if commit_date is not None:
+                dates[repo_url] = commit_date
+        return dates
+
+
+@dataclass
+class Span:
+    """Where a key or value is written in the text of a games file"""
+    start: int
+    end: int
+    # The quotes of a scalar, if any
+    style: Optional[str] = None
+    column: int = 0
+
+    @classmethod
+    def of(cls, node) -> 'Span':
+        return cls(node.start_mark.index, node.end_mark.index, node.style, node.start_mark.column)
+
+
+@dataclass
+class GamesFile:
+    """
+    A games file, the games in it and where their edited keys are written
+
+    Values are set by edits of the text of the file, applied by ``write``;
+    everything else in the file is left as it is.
+    """
+    path: Path
+    text: str
+    games: list
+    # For every game, the spans of the keys and values of EDITED_KEYS, and of the keys they are inserted before
+    spans: list
+    edits: list = field(default_factory=list)
+
+    @classmethod
+    def read(cls, path: Path) -> 'GamesFile':
+        # newline='' keeps line endings as they are written
+        with open(path, encoding='utf-8', newline='') as f:
+            text = f.read()
+        # Composed then constructed, to get both the nodes of the games and their values from a single parse
+        loader = SafeLoader(text)
+        try:
+            node = loader.get_single_node()
+            games = loader.construct_document(node)
+        finally:
+            loader.dispose()
+        located = set(EDITED_KEYS) | {key for key in EDITED_KEYS.values() if key}
+        spans = [
+            {key.value: (Span.of(key), Span.of(value)) for key, value in game.value if key.value in located}
+            for game in node.value
+        ]
+        return cls(path, text, games, spans)
+
+    def set(self, index: int, key: str, value: str):
+        """Set ``key`` of the game at ``index`` to the scalar ``value``"""
+        spans = self.spans[index]
+        if key in spans:
+            value_span = spans[key][1]
+            quote = value_span.style if value_span.style in ('"', "'") else ''
+            self.edits.append((value_span.start, value_span.end, f'{quote}{value}{quote}'))
+        elif (before := EDITED_KEYS[key]) in spans:
+            # On a line of its own, at the indentation of the key it is inserted before
+            key_span = spans[before][0]
+            self.edits.append((key_span.start, key_span.start, f"{key}: {value}\n{' ' * key_span.column}"))
+        else:
+            raise KeyError(f"{self.games[index]['name']} in {self.path} has no {key}")
+
+    def write(self) -> int:
+        """Apply the edits to the file, if any, and return how many there were"""
+        if not self.edits:
+            return 0
+        text = self.text
+        # From the end, so that the offsets of the edits still to apply stay valid
+        for start, end, replacement in sorted(self.edits, reverse=True):
+            text = text[:start] + replacement + text[end:]
+        with open(self.path, 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+        return len(self.edits)
+
+
+def needs_update(game):
+    return len(game.get('repo', '')) > 0 and game.get('development', '') != 'complete'
 
 
 def is_github_repo(repo):
     return repo.startswith('https://github.')
 
 
-def is_gitlab_repo(repo):
-    return repo.startswith(GL_HOST)
-
-
-def is_sourceforge_repo(repo):
-    return repo.startswith(SF_HOST)
-
-
-def get_latest_commit_date(repo_url, gh, gl):
-    if is_github_repo(repo_url):
-        return get_latest_commit_date_for_github(gh, repo_url)
-    elif is_gitlab_repo(repo_url):
-        return get_latest_commit_date_for_gitlab(gl, repo_url)
-    elif is_sourceforge_repo(repo_url):
-        return get_latest_commit_date_for_sourceforge(repo_url)
-
-    print('The', repo_url, 'repository could not be updated')
-
-
-def get_latest_commit_date_for_github(gh, repo_url):
-    match = re.match(GH_REGEX, repo_url)
-    if not match:
-        return
-
-    owner, repo = match.groups()
+async def get_latest_commit_date(client, repo_url) -> Optional[datetime]:
+    if parse_repo_url(repo_url) is None:
+        print('The', repo_url, 'repository could not be updated')
+        return None
     try:
-        gh_repo = gh.get_repo(f"{owner}/{repo}")
-        branches = list(gh_repo.get_branches())
-        commit_dates = {datetime.strptime(branch.commit.last_modified, GH_DT_FMT) for branch in branches if branch.commit.last_modified}
-    except GithubException as e:
-        print(f'Error getting repo info for {owner}/{repo}: {e}')
-        return
-    return max(commit_dates) if commit_dates else None
-
-
-def get_latest_commit_date_for_gitlab(gl, repo_url):
-    match = re.match(GL_REGEX, repo_url)
-
-    if not match:
-        return
-
-    project_namespace = match.groups()[0]
-    project = gl.projects.get(project_namespace)
-
-    branches = project.branches.list(get_all=True)
-    created_dates = {branch.commit["created_at"] for branch in branches}
-    last_commit = max(created_dates)
-
-    return datetime.strptime(
-        ''.join(last_commit.rsplit(':', 1)),
-        '%Y-%m-%dT%H:%M:%S.%f%z'
-    ).replace(tzinfo=None)
-
-
-def get_latest_commit_date_for_sourceforge(repo_url: str) -> Optional[datetime]:
-    if not (match := re.match(SF_REGEX, repo_url)):
-        return
-
-    project_name = match.groups()[0]
-    feed = feedparser.parse(f"https://sourceforge.net/p/{project_name}/activity/feed.rss")
-    for entry in feed.entries:
-        # Only look for commits
-        if " committed " not in entry["title"]:
-            continue
-        return datetime.fromtimestamp(mktime(entry["published_parsed"]))
-    return None
+        return await client.latest_commit_date(repo_url)
+    except ForgeError as e:
+        print(f'Error getting repo info for {repo_url}: {e}')
+        return None
+
+
+class GithubGraphQL:
+    """Fetches the latest commit dates of GitHub repos, many per GraphQL query"""
+
+    def __init__(self, transport: Transport, batch_size=50):
+        self.transport = transport
+        # GitHub caps the nodes of a query; 100 repos stay well below
+        self.batch_size = max(1, min(batch_size, 100))
+
+    @staticmethod
+    def query(count: int) -> str:
+        variables = ', '.join(f'$owner{i}: String!, $name{i}: String!' for i in range(count))
+        repos = '\n'.join(
+            f'  repo{i}: repository(owner: $owner{i}, name: $name{i}) {{\n'
+            '    pushedAt\n'
+            '    defaultBranchRef { target { ... on Commit { committedDate } } }\n'
+            '  }'
+            for i in range(count)
+        )
+        return f'query({variables}) {{\n{repos}\n}}'
+
+    async def latest_commit_dates(self, repo_urls: Iterable[str]) -> dict:
+        """The date of the latest push or commit to the default branch of every repo, by URL"""
+        repos = {}
+        for repo_url in repo_urls:
+            if match := re.match(GH_REGEX, repo_url):
+                repos.setdefault(match.groups(), []).append(repo_url)
+        dates = {}
+        names = list(repos)
+        for start in range(0, len(names), self.batch_size):
+            batch = names[start:start + self.batch_size]
+            variables = {}
+            for i, (owner, repo) in enumerate(batch):
+                variables[f'owner{i}'] = owner
+                variables[f'name{i}'] = repo
+            try:
+                response = await self.transport(self.query(len(batch)), variables)
+            except ForgeError as e:
+                print(f'Error getting the info of {len(batch)} repos: {e}')
+                continue
+            # Repos that cannot be read, e.g. removed ones, come back as null with an error each
+            for error in response.get('errors', []):
+                i = int(error['path'][0][len('repo'):]) if error.get('path') else None
+                repo = '/'.join(batch[i]) if i is not None else 'query'
+                print(f"Error getting repo info for {repo}: {error.get('message')}")
+            data = response.get('data') or {}
+            for i, key in enumerate(batch):
+                if (commit_date := parse_github_repo_date(data.get(f'repo{i}'))) is not None:
+                    for repo_url in repos[key]:
+                        dates[repo_url] = commit_date
+        return dates
+
+
+def parse_github_repo_date(repo: Optional[dict]) -> Optional[datetime]:
+    if not repo:
+        return None
+    dates = [repo.get('pushedAt')]
+    if repo.get('defaultBranchRef'):
+        dates.append(repo['defaultBranchRef']['target'].get('committedDate'))
+    dates = [datetime.strptime(commit_date, GH_GRAPHQL_DT_FMT) for commit_date in dates if commit_date]
+    return max(dates) if dates else None
 
 
 if __name__ == "__main__":
@@ -48,51 +48,197 @@ var selectedTags = window.selectedTags = new Set();
   }
 })();
 
-// search handling
-function getFilter(term) {
-  return !term ? "" :
-    '[data-index*="' + term.toLowerCase().replace(/"/g, '') + '"]';
+// lazy loading of the shards of the index
+function loadShard(shard) {
+  if (!shard.loading) {
+    shard.loading = fetch(shard.getAttribute('data-src'))
+      .then(function(response) { return response.text(); })
+      .then(function(html) {
+        var range = document.createRange();
+        range.selectNodeContents(shard.parentNode);
+        var fragment = range.createContextualFragment(html);
+        bindTags(fragment);
+        shard.replaceWith(fragment);
+      });
+  }
+  return shard.loading;
 }
 
+// Searching, filtering by tags and sorting need every game of the index
+function loadAllShards() {
+  var shards = document.querySelectorAll('.shard[data-src]');
+  return Promise.all(Array.prototype.map.call(shards, loadShard));
+}
+
+(function() {
+  var shards = document.querySelectorAll('.shard[data-src]');
+  if (!shards.length) return;
+
+  var observer = new IntersectionObserver(function(entries) {
+    entries.forEach(function(entry) {
+      if (entry.isIntersecting) {
+        observer.unobserve(entry.target);
+        loadShard(entry.target);
+      }
+    });
+  }, {rootMargin: '1000px'});
+  shards.forEach(function(shard) { observer.observe(shard); });
+})();
+
+// search handling
 var filterStyle = document.getElementById('filter-style');
+var searchIndex = null;
+var currentFilter = null;
+
+function loadSearchIndex() {
+  if (!searchIndex) {
+    searchIndex = fetch('/search.json').then(function(response) { return response.json(); });
+  }
+  return searchIndex;
+}
+
+// ids of the entries with a word containing term, e.g. "Freedoom" for "doom"
+function searchTerm(index, term) {
+  var tokens = index.tokens, ids = new Set();
+  for (var i = 0; i < tokens.length; i++) {
+    if (tokens[i].indexOf(term) === -1) continue;
+    var id = 0;
+    index.postings[i].forEach(function(gap) { id += gap; ids.add(id); });
+  }
+  return ids;
+}
+
+// Clones matching every term, and originals with a match for every term in any of their clones
+function search(index, terms) {
+  var matches = terms.map(function(term) { return searchTerm(index, term); });
+  var entries = new Set();
+  index.entries.forEach(function(entry, id) {
+    if (matches.every(function(ids) { return ids.has(id); })) {
+      entries.add(entry[0] + '\n' + entry[1]);
+    }
+  });
+  var parents = matches.map(function(ids) {
+    var found = new Set();
+    ids.forEach(function(id) { found.add(index.entries[id][0]); });
+    return found;
+  }).reduce(function(a, b) {
+    return new Set([...a].filter(function(parent) { return b.has(parent); }));
+  });
+  return {entries: entries, parents: parents};
+}
+
+function markMatches(result) {
+  // Every name of an original follows its first one, which has its id
+  var parent = null;
+  var nodes = document.getElementsByClassName('searchable');
+  for (var i = 0, l = nodes.length; i < l; i++) {
+    var el = nodes[i], match;
+    if (el.tagName == 'DT') {
+      if (el.id) { parent = el.id; }
+      match = result.parents.has(parent);
+    } else {
+      match = result.entries.has(el.getAttribute('data-parent') + '\n' + el.getAttribute('data-name'));
+    }
+    el.classList.toggle('match', match);
+  }
+}
 
 function filter(filter_value) {
-  if (!filter_value) {
+  var terms = String(filter_value || '').toLowerCase().split(' ').filter(Boolean);
+  currentFilter = filter_value;
+  if (!terms.length) {
     setQueryParams('filter', null);
     filterStyle.innerHTML = "";
-  } else {
-    setQueryParams('filter', filter_value);
-    filterStyle.innerHTML =
-      ".searchable {display: none} .searchable" +
-      filter_value.split(' ').map(getFilter).join('') +
-      "{display: block}";
+    setCount();
+    return;
   }
-  setCount();
+  setQueryParams('filter', filter_value);
+  Promise.all([loadSearchIndex(), loadAllShards()]).then(function(loaded) {
+    // The filter may have changed while loading
+    if (filter_value !== currentFilter) return;
+    markMatches(search(loaded[0], terms));
+    filterStyle.innerHTML = ".searchable {display: none} .searchable.match {display: block}";
+    setCount();
+  });
 }
 
 (function() {
-  // collect indexes on dt
-  var nodes = document.getElementsByTagName('dt');
-  for (var i = 0, l = nodes.length; i < l; i++) {
-    var el = nodes[i], next = el, index = [];
-    while ((next = next.nextElementSibling) && !next.id) {
-      if (next.tagName != 'DIV')
-        continue;
-      var childs = next.children;
-      for (var child of childs) {
-        index.push(child.getAttribute('data-index'));
-      }
-    }
-    el.setAttribute('data-index', index.join(' '));
-  };
-
   document.getElementById('filter').addEventListener('input', function() {
     filter(this.value);
   });
 })();
 
 // tag handling
-function filterBySelectedTags() {
+var selectedTagsAny = false;
+
+// Bitsets of the entries of the search index, in 32 bit words
+function decodeBits(runs, size) {
+  var bits = new Uint32Array((size + 31) >> 5), pos = 0;
+  runs.forEach(function(run, i) {
+    if (i % 2) {
+      for (var end = pos + run; pos < end; pos++) { bits[pos >> 5] |= 1 << (pos & 31); }
+    } else {
+      pos += run;
+    }
+  });
+  return bits;
+}
+
+function tagBits(index, tag) {
+  if (!index.bits) { index.bits = {single: decodeBits(index.single, index.entries.length)}; }
+  if (!index.bits['tag:' + tag]) {
+    index.bits['tag:' + tag] = decodeBits(index.tags[tag] || [], index.entries.length);
+  }
+  return index.bits['tag:' + tag];
+}
+
+function combineBits(a, b, any) {
+  var result = new Uint32Array(a.length);
+  for (var i = 0; i < a.length; i++) { result[i] = any ? a[i] | b[i] : a[i] & b[i]; }
+  return result;
+}
+
+// Number of distinct games in bits
+function countGames(index, bits) {
+  var single = index.bits.single, count = 0;
+  for (var i = 0; i < bits.length; i++) {
+    var v = bits[i] & single[i];
+    v = v - ((v >>> 1) & 0x55555555);
+    v = (v & 0x33333333) + ((v >>> 2) & 0x33333333);
+    count += (((v + (v >>> 4)) & 0x0f0f0f0f) * 0x01010101) >>> 24;
+  }
+  // Games listed under several originals count once if any of their listings is set
+  index.shared.forEach(function(ids) {
+    if (ids.some(function(id) { return (bits[id >> 5] >>> (id & 31)) & 1; })) count++;
+  });
+  return count;
+}
+
+function selectedBits(index) {
+  var bits = null;
+  selectedTags.forEach(function(tag) {
+    bits = bits ? combineBits(bits, tagBits(index, tag), selectedTagsAny) : tagBits(index, tag);
+  });
+  return bits;
+}
+
+// Show on every tag of the menu how many games selecting it would leave
+function updateTagCounts(index, selected) {
+  var tags = document.querySelectorAll('#nav .tag');
+  for (var i = 0, l = tags.length; i < l; i++) {
+    var badge = tags[i].getElementsByClassName('tag-badge')[0];
+    if (!badge) continue;
+    if (!badge.hasAttribute('data-count')) { badge.setAttribute('data-count', badge.textContent); }
+    if (!selected) {
+      badge.textContent = badge.getAttribute('data-count');
+    } else {
+      var bits = tagBits(index, tags[i].getAttribute('data-name'));
+      badge.textContent = countGames(index, combineBits(selected, bits, selectedTagsAny));
+    }
+  }
+}
+
+function filterBySelectedTags(index) {
   var games = document.getElementsByTagName('dd');
   var parentHasActive = {};
 
@@ -108,25 +254,23 @@ function filterBySelectedTags() {
     for (var d = 0; d < dts.length; d++) {
       dts[d].classList.remove('active');
     }
+    if (index) updateTagCounts(index, null);
     setCount();
     return;
   }
 
   document.body.classList.add('tags-active');
 
+  var selected = selectedBits(index);
+  if (!index.ids) {
+    index.ids = new Map(index.entries.map(function(entry, id) { return [entry[0] + '\n' + entry[1], id]; }));
+  }
   for (var i = 0, len = games.length; i < len; i += 1) {
     var game = games[i];
-    var tagsAttr = game.getAttribute('data-tags') || '';
-    var gameTags = tagsAttr.split(' ').filter(Boolean);
     var parentId = game.getAttribute('data-parent');
+    var id = index.ids.get(parentId + '\n' + game.getAttribute('data-name'));
 
-    // Check if game contains all selected tags
-    var matchesAll = true;
-    selectedTags.forEach(function(t){
-      if (gameTags.indexOf(t) === -1) { matchesAll = false; }
-    });
-
-    if (matchesAll) {
+    if (id !== undefined && (selected[id >> 5] >>> (id & 31)) & 1) {
       game.classList.add('active');
       parentHasActive[parentId] = true;
     } else {
@@ -142,6 +286,7 @@ function filterBySelectedTags() {
     else dt.classList.remove('active');
   }
 
+  updateTagCounts(index, selected);
   setCount();
 }
 
@@ -160,21 +305,23 @@ function sortByUpdated(e) {
     btn.innerHTML = "Originals";
 
     if (!sorted.hasChildNodes()) {
-      const games = [...document.getElementsByTagName('dd')];
-      var gameList = [];
-      let gameNames = new Set();
-      games.forEach(game => {
-        if (!gameNames.has(game.dataset.name)) {
-          gameNames.add(game.dataset.name);
-          gameList.push(game.cloneNode(true));
-        }
-      });
-      gameList.sort(function(a,b) {
-        return b.dataset.updated.localeCompare(a.dataset.updated);
-      });
+      loadAllShards().then(function() {
+        const games = [...document.getElementsByTagName('dd')];
+        var gameList = [];
+        let gameNames = new Set();
+        games.forEach(game => {
+          if (!gameNames.has(game.dataset.name)) {
+            gameNames.add(game.dataset.name);
+            gameList.push(game.cloneNode(true));
+          }
+        });
+        gameList.sort(function(a,b) {
+          return b.dataset.updated.localeCompare(a.dataset.updated);
+        });
 
-      gameList.forEach(game => {
-        sorted.appendChild(game);
+        gameList.forEach(game => {
+          sorted.appendChild(game);
+        });
       });
     }
   }
@@ -208,6 +355,20 @@ function renderSelectedTagsBar() {
   label.style.marginRight = '8px';
   container.appendChild(label);
 
+  if (selectedTags.size > 1) {
+    var match = document.createElement('span');
+    match.className = 'tag-match';
+    match.textContent = selectedTagsAny ? 'any of' : 'all of';
+    match.title = 'Click to show games with ' + (selectedTagsAny ? 'all' : 'any') + ' of the selected tags';
+    match.style.marginRight = '8px';
+    match.style.cursor = 'pointer';
+    match.addEventListener('click', function() {
+      selectedTagsAny = !selectedTagsAny;
+      updateTagsUI();
+    });
+    container.appendChild(match);
+  }
+
   selectedTags.forEach(function(tag){
     var el = document.createElement('span');
     el.className = 'tag';
@@ -225,10 +386,13 @@ function updateTagsUI() {
   // Highlights + selected tags bar + filter + URL
   highlightTagsMulti();
   renderSelectedTagsBar();
-  filterBySelectedTags();
+  Promise.all([loadSearchIndex(), loadAllShards()]).then(function(loaded) {
+    filterBySelectedTags(loaded[0]);
+  });
   // Update URL query param
   if (selectedTags.size === 0) setQueryParams('tag', null);
   else setQueryParams('tag', Array.from(selectedTags).join(','));
+  setQueryParams('match', selectedTags.size > 1 && selectedTagsAny ? 'any' : null);
 }
 
 function toggleTagByName(curTag) {
@@ -241,20 +405,22 @@ function toggleTagByName(curTag) {
   updateTagsUI();
 }
 
-(function() {
-  function onTagClick(e) {
-    var t = e.target.closest && e.target.closest('.tag');
-    if (!t || !t.hasAttribute('data-name')) return;
-    var curTag = t.getAttribute('data-name');
-    toggleTagByName(curTag);
-  }
+function onTagClick(e) {
+  var t = e.target.closest && e.target.closest('.tag');
+  if (!t || !t.hasAttribute('data-name')) return;
+  var curTag = t.getAttribute('data-name');
+  toggleTagByName(curTag);
+}
 
-  // Attach to all existing tags
-  var tags = document.getElementsByClassName('tag');
+function bindTags(root) {
+  var tags = root.querySelectorAll('.tag');
   for (var i = 0, l = tags.length; i < l; i += 1) {
     tags[i].addEventListener('click', onTagClick);
   }
-})();
+}
+
+// Attach to all existing tags
+bindTags(document);
 
 // image validation
 (function() {
@@ -416,6 +582,9 @@ function setQueryParams(key, value) {
 }
 
 function setCount() {
+  // Until every shard of the index is loaded, keep the count rendered with the page
+  if (document.querySelector('.shard[data-src]')) return;
+
   var list = document.getElementById('list');
   var sorted = document.getElementById('sorted');
 
@@ -434,6 +603,7 @@ function setCount() {
 
 (function () {
   params = getQueryParams();
+  selectedTagsAny = params['match'] === 'any';
   if (params.hasOwnProperty('tag')) {
     var raw = (params['tag'] + '').split(',').map(function(s){ return s.trim(); }).filter(Boolean);
     raw.forEach(function(t){ selectedTags.add(t); });